@@ -0,0 +1,144 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from .interests import tag_ids_for
+from .matching import encode_features
+from .models import Gender, Match, Recommendation, RecommendationSet, User, UserPreferences
+
+# --- SYNTHETIC POPULATION ---
+CITIES = ['Nairobi', 'Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', None]
+CLEANLINESS = ['low', 'medium', 'high', None]
+SLEEP = ['early', 'late', 'flexible']
+INTERESTS = [
+    'football', 'music', 'cooking', 'hiking', 'gaming', 'reading', 'movies', 'fitness',
+    'travel', 'art', 'photography', 'dancing', 'swimming', 'basketball', 'chess', 'church',
+]
+GENDERS = [Gender.MALE, Gender.FEMALE]
+
+
+def _rng(seed, n):
+    # One generator per user, so user n is identical whatever the population size
+    return random.Random(f'{seed}:{n}')
+
+
+def generate_population(size, seed=0, match_rate=0.05, batch_size=5000):
+    """
+    Grows the synthetic population (users, preferences, interests and matches)
+    to `size` users. Deterministic for a given seed; bypasses signals.
+    """
+    tag_ids = tag_ids_for(set(INTERESTS))
+    Through = UserPreferences.interest_tags.through
+    start = User.objects.filter(email__startswith='bench').count()
+
+    for offset in range(start, size, batch_size):
+        numbers = range(offset, min(offset + batch_size, size))
+        rngs = {n: _rng(seed, n) for n in numbers}
+
+        users = User.objects.bulk_create([
+            User(
+                email=f'bench{n}@example.com', phone_number=f'+2547{n:08d}', full_name=f'Bench User {n}',
+                gender=rngs[n].choice(GENDERS), password='!',
+            )
+            for n in numbers
+        ])
+
+        prefs, interests = [], []
+        for n, user in zip(numbers, users):
+            rng = rngs[n]
+            tags = rng.sample(INTERESTS, rng.randint(0, 3))
+            p = UserPreferences(
+                user=user,
+                cleanliness_level=rng.choice(CLEANLINESS),
+                smoking=rng.random() < 0.2,
+                pets=rng.random() < 0.3,
+                guests_allowed=rng.random() < 0.5,
+                sleep_schedule=rng.choice(SLEEP),
+                city=rng.choice(CITIES),
+                other_interests=', '.join(tags) or None,
+                is_actively_looking=rng.random() < 0.8,
+            )
+            p.feature_vector = encode_features(p)
+            p.interest_ids = sorted(tag_ids[t] for t in tags)
+            prefs.append(p)
+            interests.append(tags)
+        UserPreferences.objects.bulk_create(prefs)
+
+        Through.objects.bulk_create([
+            Through(userpreferences_id=p.pk, interesttag_id=tag_ids[t])
+            for p, tags in zip(prefs, interests) for t in tags
+        ])
+
+        # A few users already sent a request to someone earlier in the population
+        matches = []
+        for n, user in zip(numbers, users):
+            if n and rngs[n].random() < match_rate:
+                other = rngs[n].randrange(n)
+                matches.append((user, f'bench{other}@example.com'))
+        targets = dict(User.objects.filter(email__in=[e for _, e in matches]).values_list('email', 'user_id'))
+        Match.objects.bulk_create(
+            [Match(user=user, matched_user_id=targets[email], compatibility_score=0) for user, email in matches],
+            ignore_conflicts=True,
+        )
+
+
+def reset_recommendations():
+    """
+    Drops every stored recommendation set and memoized score. generate_population
+    bypasses the signals that would invalidate them, so sets built at a smaller
+    size would otherwise be served (stale) at the next one.
+    """
+    Recommendation.objects.all().delete()
+    RecommendationSet.objects.all().delete()
+    cache.clear()
+
+
+# --- MEASUREMENT ---
+def _summary(values):
+    values = sorted(values)
+    return {
+        'median': round(statistics.median(values), 2),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+        'max': round(values[-1], 2),
+    }
+
+
+def measure_recommendations(engine, users, repeat=3):
+    """
+    Calls /matches/recommendations/ for each user with `engine`: the first call
+    is reported as cold, the next `repeat` as warm. Peak memory is measured in
+    a separate call, since tracemalloc slows everything down.
+    """
+    client = APIClient()
+    cold, warm, queries, peaks = [], [], [], []
+
+    with override_settings(RECOMMENDATION_ENGINE=engine):
+        for user in users:
+            client.force_authenticate(user)
+            for attempt in range(repeat + 1):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get('/api/matches/recommendations/')
+                    elapsed = (time.perf_counter() - started) * 1000
+                assert response.status_code == 200, response.data
+                (cold if attempt == 0 else warm).append(elapsed)
+                queries.append(len(captured))
+
+            tracemalloc.start()
+            client.get('/api/matches/recommendations/')
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+
+    return {
+        'engine': engine,
+        'cold_ms': _summary(cold),
+        'warm_ms': _summary(warm),
+        'queries': _summary(queries),
+        'peak_memory_kb': _summary(peaks),
+    }
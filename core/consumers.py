@@ -0,0 +1,76 @@
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+from .serializers import MessageSerializer
+
+
+def user_group(user_id):
+    return f"user-{user_id}"
+
+
+def push_message(message, recipient_ids):
+    """
+    Sends a new message to the open sockets of `recipient_ids`.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    payload = MessageSerializer(message).data
+    for user_id in recipient_ids:
+        async_to_sync(channel_layer.group_send)(user_group(user_id), {"type": "chat.message", "message": payload})
+
+
+class JWTAuthMiddleware:
+    """
+    Authenticates sockets with the same access token as the REST API, passed
+    as ?token=<access token> since mobile WebSocket clients cannot set headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        scope = dict(scope, user=await self.get_user(token))
+        return await self.app(scope, receive, send)
+
+    @database_sync_to_async
+    def get_user(self, token):
+        if not token:
+            return AnonymousUser()
+        auth = JWTAuthentication()
+        try:
+            return auth.get_user(auth.get_validated_token(token))
+        except (InvalidToken, TokenError, AuthenticationFailed):
+            return AnonymousUser()
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    One socket per signed-in user: every message sent to them arrives as
+    {"type": "message", "message": {...}}, in the shape of the messages endpoint.
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.group = user_group(self.user.pk)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group'):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def chat_message(self, event):
+        message = dict(event['message'], is_me=event['message']['sender'] == self.user.pk)
+        await self.send_json({"type": "message", "message": message})
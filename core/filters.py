@@ -0,0 +1,65 @@
+from collections import Counter
+
+import django_filters
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from .models import RoomListing, RoomType
+
+# Monthly rent buckets (KES) reported in the facets: (label, low, high), high exclusive
+RENT_BUCKETS = [
+    ('0-10000', None, 10000),
+    ('10000-20000', 10000, 20000),
+    ('20000-40000', 20000, 40000),
+    ('40000+', 40000, None),
+]
+
+
+class RoomListingFilter(django_filters.FilterSet):
+    rent_min = django_filters.NumberFilter(field_name='rent_amount', lookup_expr='gte')
+    rent_max = django_filters.NumberFilter(field_name='rent_amount', lookup_expr='lte')
+    room_type = django_filters.MultipleChoiceFilter(choices=RoomType.choices)
+    city = django_filters.CharFilter(field_name='city', lookup_expr='iexact')
+    # Available by this date: no date set means available now
+    available_from = django_filters.DateFilter(method='filter_available_from')
+
+    class Meta:
+        model = RoomListing
+        fields = ['rent_min', 'rent_max', 'room_type', 'city', 'available_from']
+
+    def filter_available_from(self, queryset, name, value):
+        return queryset.filter(Q(available_from__lte=value) | Q(available_from__isnull=True))
+
+
+def _rent_bucket():
+    whens = []
+    for label, low, high in RENT_BUCKETS:
+        condition = Q()
+        if low is not None:
+            condition &= Q(rent_amount__gte=low)
+        if high is not None:
+            condition &= Q(rent_amount__lt=high)
+        whens.append(When(condition, then=Value(label)))
+    return Case(*whens, output_field=CharField())
+
+
+def listing_facets(queryset):
+    """
+    Listings per room type, per city and per rent bucket within `queryset`,
+    from one GROUP BY over the three columns, rolled up here.
+    """
+    rows = queryset.order_by().annotate(rent_bucket=_rent_bucket()).values(
+        'room_type', 'city', 'rent_bucket'
+    ).annotate(n=Count('listing_id'))
+
+    room_types, cities, rents = Counter(), Counter(), Counter()
+    for row in rows:
+        # Cities are filtered case-insensitively, so they are counted that way too
+        room_types[row['room_type']] += row['n']
+        cities[row['city'].title()] += row['n']
+        rents[row['rent_bucket']] += row['n']
+
+    return {
+        'room_type': dict(sorted(room_types.items(), key=lambda item: (-item[1], item[0]))),
+        'city': dict(sorted(cities.items(), key=lambda item: (-item[1], item[0]))),
+        'rent': {label: rents[label] for label, _, _ in RENT_BUCKETS},
+    }
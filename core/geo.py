@@ -0,0 +1,89 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_PRECISION = 9  # ~5 m cells, plenty for a listing
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DEFAULT_NEAR_RADIUS_KM = 5
+MAX_NEAR_RADIUS_KM = 50
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """
+    Standard base32 geohash: nearby points share a prefix, so a btree index
+    on the hash answers "in this cell" as a prefix range scan.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = value * 2 + 1
+            rng[0] = mid
+        else:
+            value *= 2
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size_degrees(precision):
+    """
+    (height, width) in degrees of a geohash cell of `precision` characters.
+    """
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(lat, lon, radius_km):
+    """
+    Geohash prefixes of the 3x3 block of cells around (lat, lon), at the finest
+    precision whose cells are still at least `radius_km` wide: the circle never
+    reaches past that block.
+    """
+    km_per_lon_degree = 111.32 * max(math.cos(math.radians(lat)), 0.01)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size_degrees(candidate)
+        if height * 110.57 >= radius_km and width * km_per_lon_degree >= radius_km:
+            precision = candidate
+            break
+
+    height, width = cell_size_degrees(precision)
+    cells = set()
+    for dlat in (-1, 0, 1):
+        for dlon in (-1, 0, 1):
+            cell_lat = min(max(lat + dlat * height, -90.0), 90.0)
+            cell_lon = (lon + dlon * width + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(cell_lat, cell_lon, precision))
+    return sorted(cells)
+
+
+def in_cells(cells, field='geohash'):
+    return Q(*[Q(**{f'{field}__startswith': cell}) for cell in cells], _connector=Q.OR)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat, dlon = math.radians(lat2 - lat1), math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def distance_km(lat, lon, lat_field='latitude', lon_field='longitude'):
+    """
+    Database expression for the haversine distance from (lat, lon) to each row.
+    """
+    dlat = Radians(F(lat_field) - Value(lat)) / 2
+    dlon = Radians(F(lon_field) - Value(lon)) / 2
+    a = Power(Sin(dlat), 2) + math.cos(math.radians(lat)) * Cos(Radians(F(lat_field))) * Power(Sin(dlon), 2)
+    # LEAST guards asin against rounding just above 1
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))), output_field=FloatField())
@@ -0,0 +1,157 @@
+import io
+import logging
+import os
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageStatus, ListingImage, UserVerification
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels; smaller originals are never upscaled
+VARIANTS = {'thumb': 320, 'medium': 800, 'full': 1600}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# How long a claimed upload stays with its worker; past it, a crashed worker's uploads are processed again
+LEASE = timedelta(minutes=10)
+
+# Every model with uploads to process: model -> its ImageField
+SOURCES = {
+    ListingImage: 'image_file',
+    UserVerification: 'document_image',
+}
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent images onto white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(source):
+    """
+    Yields (name, format, bytes, size) for each variant of the image in `source`:
+    rotated upright from its EXIF orientation, resized, re-encoded as WebP and
+    progressive JPEG. The encoders are given no EXIF, so none is kept.
+    """
+    with Image.open(source) as original:
+        image = _flatten(ImageOps.exif_transpose(original))
+
+    for name, edge in VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+
+        webp = io.BytesIO()
+        variant.save(webp, 'WEBP', quality=WEBP_QUALITY, method=4)
+        yield name, 'webp', webp.getvalue(), variant.size
+
+        jpeg = io.BytesIO()
+        variant.save(jpeg, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        yield name, 'jpeg', jpeg.getvalue(), variant.size
+
+
+def strip_metadata(source):
+    """
+    Returns the image in `source` re-encoded in its own format, rotated upright
+    and without EXIF, so the stored original no longer carries the GPS position.
+    """
+    with Image.open(source) as original:
+        # Phones save JPEGs as MPO (JPEG plus depth frames): keep the main picture
+        fmt = 'JPEG' if original.format == 'MPO' else original.format
+        icc_profile = original.info.get('icc_profile')
+        image = ImageOps.exif_transpose(original)
+    image.info = {}
+
+    options = {'quality': 95} if fmt == 'JPEG' else {}
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    output = io.BytesIO()
+    image.save(output, fmt, **options)
+    return output.getvalue()
+
+
+def process_image(instance, lease):
+    """
+    Renders and stores the variants of one claimed upload and an EXIF-free copy
+    of the original, outside any transaction, then records them on the row in
+    a short one if the claim under `lease` still holds.
+    """
+    field_name = SOURCES[type(instance)]
+    field = getattr(instance, field_name)
+    storage = field.storage
+    stem = os.path.splitext(field.name)[0]
+
+    variants = {}
+    with field.open('rb') as source:
+        for name, fmt, data, (width, height) in render_variants(source):
+            path = storage.save(f"variants/{stem}/{name}.{fmt}", ContentFile(data))
+            variants.setdefault(name, {'width': width, 'height': height})[fmt] = path
+        source.seek(0)
+        stripped = strip_metadata(source)
+
+    # Saved next to the original rather than over it, which is only removed once the row points away
+    original = field.name
+    cleaned = storage.save(original, ContentFile(stripped), max_length=field.field.max_length)
+
+    with transaction.atomic():
+        recorded = type(instance).objects.filter(
+            pk=instance.pk, processing_status=ImageStatus.PROCESSING, lease_until=lease
+        ).update(**{field_name: cleaned}, variants=variants, processing_status=ImageStatus.READY, lease_until=None)
+        if recorded:
+            transaction.on_commit(lambda: storage.delete(original))
+    if not recorded:
+        # The lease ran out and another worker took the upload over: drop this run's files
+        for path in [cleaned] + [variant[fmt] for variant in variants.values() for fmt in ('webp', 'jpeg')]:
+            storage.delete(path)
+
+
+def _claim(model, batch_size):
+    """
+    Claims up to `batch_size` pending uploads of `model`, plus any whose lease
+    ran out, by moving them to 'processing' under a fresh lease, in one short
+    transaction. SKIP LOCKED lets several workers share the queue.
+    Returns (claimed, lease).
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        batch = list(model.objects.select_for_update(skip_locked=True).filter(
+            Q(processing_status=ImageStatus.PENDING)
+            | Q(processing_status=ImageStatus.PROCESSING, lease_until__lt=now)
+        ).order_by('pk')[:batch_size])
+        lease = now + LEASE
+        model.objects.filter(pk__in=[instance.pk for instance in batch]).update(
+            processing_status=ImageStatus.PROCESSING, lease_until=lease
+        )
+    return batch, lease
+
+
+def process_pending_images(batch_size=20):
+    """
+    Processes up to `batch_size` pending uploads of each model. Only claiming
+    them and writing each outcome take a transaction; decoding and encoding run
+    outside any. Returns the number of rows handled.
+    """
+    handled = 0
+    for model in SOURCES:
+        batch, lease = _claim(model, batch_size)
+        for instance in batch:
+            try:
+                process_image(instance, lease)
+            except Exception:
+                # A broken upload must not block the queue
+                logger.exception("Could not process %s %s", model.__name__, instance.pk)
+                with transaction.atomic():
+                    model.objects.filter(
+                        pk=instance.pk, processing_status=ImageStatus.PROCESSING, lease_until=lease
+                    ).update(processing_status=ImageStatus.FAILED, lease_until=None)
+        handled += len(batch)
+    return handled
@@ -0,0 +1,137 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Conversation, InboxEntry, Message
+
+SYNC_MESSAGE_LIMIT = 500
+# Seconds sync waits on a running transaction; later commits of one older than that may be missed
+SYNC_MAX_TRANSACTION_AGE = 60
+
+
+def open_inbox(conversation, participants):
+    """
+    Creates the missing inbox rows of `conversation`, one per participant.
+    """
+    InboxEntry.objects.bulk_create(
+        [
+            InboxEntry(
+                user=user, conversation=conversation,
+                other_participant=next((other for other in participants if other.pk != user.pk), None),
+                last_activity_at=conversation.created_at,
+            )
+            for user in participants
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def direct_conversation(user, other):
+    """
+    Returns (conversation, created) for the one direct conversation of the two
+    users, creating it with its inbox rows if needed. Looked up by the pair key;
+    concurrent calls end up on the same row thanks to its unique constraint.
+    """
+    low, high = sorted((user, other), key=lambda u: u.pk)
+    with transaction.atomic():
+        # get_or_create retries the lookup if a concurrent insert wins the race
+        conversation, created = Conversation.objects.get_or_create(user_low=low, user_high=high)
+        if created:
+            conversation.participants.add(low, high)
+            open_inbox(conversation, [low, high])
+    return conversation, created
+
+
+def record_message(message):
+    """
+    Points every inbox row of the conversation at `message` and bumps the
+    unread count of everyone but the sender.
+    """
+    fields = {
+        'last_message': message,
+        'last_message_text': message.message_text,
+        'last_message_at': message.sent_at,
+        'last_activity_at': message.sent_at,
+    }
+    entries = InboxEntry.objects.filter(conversation_id=message.conversation_id)
+    if not entries.filter(user_id=message.sender_id).update(**fields):
+        # Conversation created outside `start`: build its rows first
+        open_inbox(message.conversation, list(message.conversation.participants.all()))
+        entries.filter(user_id=message.sender_id).update(**fields)
+    entries.exclude(user_id=message.sender_id).update(unread_count=F('unread_count') + 1, **fields)
+
+
+def mark_conversation_read(entry, up_to=None):
+    """
+    Marks the messages other participants sent in `entry`'s conversation as read
+    for its user, up to message id `up_to` (everything if None), in one UPDATE,
+    then recounts what is still unread. Returns (marked, unread_count).
+    """
+    unread = Message.objects.filter(conversation_id=entry.conversation_id, is_read=False).exclude(sender_id=entry.user_id)
+    with transaction.atomic():
+        marked = (unread.filter(message_id__lte=up_to) if up_to is not None else unread).update(is_read=True)
+
+        # Recount rather than subtract, so concurrent sends can never skew the counter
+        remaining = unread.order_by().values('conversation_id').annotate(n=Count('message_id')).values('n')
+        InboxEntry.objects.filter(pk=entry.pk).update(unread_count=Coalesce(Subquery(remaining), Value(0)))
+    entry.refresh_from_db(fields=['unread_count'])
+    return marked, entry.unread_count
+
+
+def _snapshot():
+    """
+    (xmin, xmax, now) of a fresh snapshot: every transaction below xmin has
+    finished, none from xmax on had started; now in epoch seconds.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_snapshot_xmin(s)::text::bigint, pg_snapshot_xmax(s)::text::bigint,'
+            ' extract(epoch FROM now())::bigint FROM pg_current_snapshot() s'
+        )
+        return cursor.fetchone()
+
+
+def changes_since(user, since=None, limit=SYNC_MESSAGE_LIMIT):
+    """
+    Everything that changed for `user` after the `since` watermark: inbox rows,
+    and new or updated messages across all of their conversations, at most
+    `limit` of them. Returns (entries, messages, watermark, has_more). Without a
+    watermark only the inbox comes back; history is paged through the messages endpoint.
+
+    Committed changes come back right away. Since a transaction still running
+    may commit rows stamped below them, each round starts again from the oldest
+    transaction that was running at the previous one, and clients de-duplicate
+    by id. That floor waits at most SYNC_MAX_TRANSACTION_AGE on a transaction,
+    so a long unrelated one cannot make the redelivered window grow for good.
+
+    The watermark is (floor, after_xid, after_id, mark_xid, mark_at): where the
+    next round starts, the last message returned while paging through a round
+    ((0, 0) between rounds), and a snapshot xmax with its time, to tell when
+    everything that was running then has run too long to wait on.
+    """
+    xmin, xmax, now = _snapshot()
+    entries = InboxEntry.objects.filter(user=user)
+    if since is None:
+        return entries, [], (xmin, 0, 0, xmax, now), False
+
+    floor, after_xid, after_id, mark_xid, mark_at = since
+    if after_id:
+        entries = entries.none()
+    else:
+        # A new round: from the floor, then the next one starts where xmin stands now
+        after_xid, floor, entries = floor, max(floor, xmin), entries.filter(change_xid__gte=floor)
+
+    messages = list(Message.objects.filter(
+        conversation__inbox_entries__user=user
+    ).filter(
+        Q(change_xid__gt=after_xid) | Q(change_xid=after_xid, message_id__gt=after_id)
+    ).select_related('sender').order_by('change_xid', 'message_id')[:limit + 1])
+
+    if len(messages) > limit:
+        # Resume right after the last message sent, within the same round
+        messages = messages[:limit]
+        return entries, messages, (floor, messages[-1].change_xid, messages[-1].message_id, mark_xid, mark_at), True
+
+    if now - mark_at >= SYNC_MAX_TRANSACTION_AGE:
+        floor, mark_xid, mark_at = max(floor, mark_xid), xmax, now
+    return entries, messages, (floor, 0, 0, mark_xid, mark_at), False
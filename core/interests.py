@@ -0,0 +1,33 @@
+from .models import InterestTag
+
+
+def parse_interests(text):
+    """
+    Splits the comma separated `other_interests` text into a set of normalized tags.
+    """
+    if not text:
+        return set()
+    return set(x.strip().lower() for x in text.split(',')) - {''}
+
+
+def tag_ids_for(names):
+    """
+    Returns {name: tag_id} for the given normalized names, creating missing tags.
+    """
+    if not names:
+        return {}
+    found = dict(InterestTag.objects.filter(name__in=names).values_list('name', 'tag_id'))
+    missing = set(names) - set(found)
+    if missing:
+        InterestTag.objects.bulk_create([InterestTag(name=name) for name in missing], ignore_conflicts=True)
+        found.update(InterestTag.objects.filter(name__in=missing).values_list('name', 'tag_id'))
+    return found
+
+
+def sync_interest_tags(prefs):
+    """
+    Points `prefs.interest_tags` at the tags of its `other_interests`, returns their ids.
+    """
+    tag_ids = list(tag_ids_for(parse_interests(prefs.other_interests)).values())
+    prefs.interest_tags.set(tag_ids)
+    return tag_ids
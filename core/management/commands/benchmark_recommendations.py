@@ -0,0 +1,89 @@
+import json
+import platform
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from core.benchmarks import generate_population, measure_recommendations, reset_recommendations
+from core.models import User
+
+ENGINES = ['python', 'database', 'materialized']
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks /matches/recommendations/ on a seeded synthetic population, '
+        'in a throwaway test database, and writes a JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=5, help='Requesting users sampled per size.')
+        parser.add_argument('--repeat', type=int, default=3, help='Warm requests per user.')
+        parser.add_argument('--output', default='recommendations_benchmark.json')
+
+    def handle(self, *args, **options):
+        # Never touch the real data: everything runs in a fresh test database,
+        # with a private cache that can be cleared between sizes
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'seed': options['seed'],
+                'commit': self.git_commit(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'created_at': timezone.now().isoformat(),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def run(self, options):
+        results = []
+        for size in sorted(options['sizes']):
+            started = time.monotonic()
+            generate_population(size, seed=options['seed'])
+            # Every size starts cold: no set built at the previous size survives
+            reset_recommendations()
+            self.stdout.write(f"Population of {size:,} users ready in {time.monotonic() - started:.1f}s")
+
+            users = list(User.objects.filter(
+                email__in=[f'bench{n}@example.com' for n in range(options['users'])]
+            ).select_related('preferences').order_by('user_id'))
+
+            for engine in options['engines']:
+                result = measure_recommendations(engine, users, repeat=options['repeat'])
+                result['users'] = size
+                results.append(result)
+                self.stdout.write(
+                    f"{size:>7,} users  {engine:<12} warm {result['warm_ms']['median']:>9.1f} ms  "
+                    f"cold {result['cold_ms']['median']:>9.1f} ms  queries {result['queries']['median']:>5}  "
+                    f"peak {result['peak_memory_kb']['max']:>9.0f} KiB"
+                )
+        return results
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
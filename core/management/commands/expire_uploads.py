@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.uploads import expire_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Deletes chunked uploads abandoned before they were finalized, with their temp files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Age after the last chunk at which an upload is abandoned.')
+
+    def handle(self, *args, **options):
+        removed = expire_stale_uploads(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} stale uploads"))
@@ -0,0 +1,198 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from core.matching import load_preference_rows, PreferenceMatrix
+from core.models import Match, Recommendation, RecommendationSet, UserPreferences
+from core.recommendations import top_candidates, SCORING_VERSION
+
+# --- WORKER SIDE (no database access) ---
+_matrix = None
+
+
+def _init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+
+
+def _score_shard(task):
+    """
+    Scores every seeker of one shard against the candidate matrix of its gender,
+    keeping the top candidates of each (and the cutoff to store with them).
+    """
+    key, seekers = task
+    results = []
+    for prefs, excluded in seekers:
+        scores = _matrix.score(prefs)
+        # Never the seeker themself or anyone they are matched with
+        scores[np.isin(_matrix.user_ids, [prefs.user_id, *excluded])] = -1
+        top, cutoff = top_candidates(_matrix, scores)
+        results.append((prefs.user_id, top, cutoff))
+    return key, results, len(seekers) * len(_matrix)
+
+
+class CopyStream:
+    """
+    File-like reader over an iterator of text chunks, for COPY ... FROM STDIN:
+    rows are formatted one seeker at a time as the driver reads them, not
+    gathered into one buffer first.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.pending += chunk
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class Command(BaseCommand):
+    help = 'Precomputes stored recommendations for every active seeker using a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Size of the process pool.')
+        parser.add_argument('--shard-size', type=int, default=500, help='Maximum seekers per shard.')
+        parser.add_argument('--checkpoint', help='JSON file recording finished shards, so an interrupted run can resume.')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        done = set()
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = set(json.load(f))
+            self.stdout.write(f"Resuming: {len(done)} shards already done.")
+
+        # Who is matched with whom: these pairs are never recommended
+        matched = defaultdict(set)
+        for user_id, other_id in Match.objects.values_list('user_id', 'matched_user_id').iterator():
+            matched[user_id].add(other_id)
+            matched[other_id].add(user_id)
+
+        started = time.monotonic()
+        total_pairs = total_seekers = 0
+
+        # Recommendations never cross genders, so each gender is scored on its own
+        genders = UserPreferences.objects.values_list('user__gender', flat=True).distinct()
+        for gender in sorted(genders):
+            candidates = load_preference_rows(UserPreferences.objects.filter(
+                user__gender=gender, user__is_staff=False, user__is_superuser=False
+            ))
+            seekers = load_preference_rows(UserPreferences.objects.filter(
+                user__gender=gender, user__is_active=True, user__is_staff=False,
+                user__is_superuser=False, is_actively_looking=True
+            ))
+            tasks = [task for task in self.shard(gender, seekers, matched, options['shard_size']) if task[0] not in done]
+            if not tasks:
+                continue
+
+            # Workers only do CPU work; never share DB connections across fork
+            connections.close_all()
+            matrix = PreferenceMatrix(candidates)
+            with multiprocessing.Pool(options['workers'], initializer=_init_worker, initargs=(matrix,)) as pool:
+                for key, results, pairs in pool.imap_unordered(_score_shard, tasks):
+                    self.store(results)
+                    done.add(key)
+                    if checkpoint:
+                        self.save_checkpoint(checkpoint, done)
+
+                    total_pairs += pairs
+                    total_seekers += len(results)
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(f"{key}: {len(results)} seekers, {total_pairs / elapsed:,.0f} pairs/sec")
+
+        elapsed = time.monotonic() - started
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {total_pairs:,} pairs for {total_seekers:,} seekers in {elapsed:.1f}s "
+            f"({total_pairs / max(elapsed, 1e-9):,.0f} pairs/sec)"
+        ))
+
+    def shard(self, gender, seekers, matched, shard_size):
+        """
+        Groups seekers into (gender, city) blocks, split further to at most `shard_size`.
+        Shard keys are deterministic so a checkpoint stays valid between runs.
+        """
+        blocks = defaultdict(list)
+        for prefs in sorted(seekers, key=lambda p: p.user_id):
+            blocks[(prefs.city or '').strip().lower()].append(prefs)
+
+        for city, members in sorted(blocks.items()):
+            for start in range(0, len(members), shard_size):
+                key = f"{gender}|{city}|{start // shard_size}"
+                chunk = [(prefs, sorted(matched.get(prefs.user_id, ()))) for prefs in members[start:start + shard_size]]
+                yield key, chunk
+
+    def store(self, results):
+        seeker_ids = [user_id for user_id, _, _ in results]
+        now = timezone.now()
+        with transaction.atomic():
+            Recommendation.objects.filter(user_id__in=seeker_ids).delete()
+            if connection.vendor == 'postgresql':
+                self.copy_recommendations(results)
+            else:
+                Recommendation.objects.bulk_create(
+                    (
+                        Recommendation(user_id=user_id, candidate_id=candidate_id, compatibility_score=score)
+                        for user_id, top, _ in results
+                        for candidate_id, score in top
+                    ),
+                    batch_size=5000,
+                    ignore_conflicts=True,
+                )
+            RecommendationSet.objects.bulk_create(
+                [
+                    RecommendationSet(
+                        user_id=user_id, version=SCORING_VERSION, refreshed_at=now,
+                        cutoff_score=cutoff[0] if cutoff else None, cutoff_candidate=cutoff[1] if cutoff else None,
+                    )
+                    for user_id, _, cutoff in results
+                ],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['version', 'refreshed_at', 'cutoff_score', 'cutoff_candidate'],
+            )
+
+    def copy_recommendations(self, results):
+        # COPY is an order of magnitude faster than INSERTs for millions of rows. It goes
+        # through a staging table: a preference save may have written a newer score
+        # into one of these sets since the delete, and that row is kept.
+        table = Recommendation._meta.db_table
+        lines = (
+            ''.join(f"{user_id}\t{candidate_id}\t{score}\n" for candidate_id, score in top)
+            for user_id, top, _ in results
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE recommendations_load '
+                '(user_id integer, candidate_id integer, compatibility_score smallint) ON COMMIT DROP'
+            )
+            cursor.cursor.copy_expert(
+                'COPY recommendations_load (user_id, candidate_id, compatibility_score) FROM STDIN', CopyStream(lines)
+            )
+            cursor.execute(
+                f'INSERT INTO "{table}" (user_id, candidate_id, compatibility_score) '
+                'SELECT user_id, candidate_id, compatibility_score FROM recommendations_load '
+                'ON CONFLICT (user_id, candidate_id) DO NOTHING'
+            )
+
+    def save_checkpoint(self, path, done):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(sorted(done), f)
+        os.replace(tmp, path)
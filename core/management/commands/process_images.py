@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = 'Renders the resized, EXIF-free variants of pending listing and verification uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Uploads per model per batch.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to wait when nothing is pending.')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is pending instead of polling.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            handled = process_pending_images(options['batch_size'])
+            total += handled
+            if handled:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} images"))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.recommendations import refresh_queued_recommendations, REFRESH_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Rescores the stored recommendations of users queued by preference, account and match changes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REFRESH_BATCH_SIZE, help='Users claimed per batch.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when nothing is queued.')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is queued instead of polling.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            handled = refresh_queued_recommendations(options['batch_size'])
+            total += handled
+            if handled:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {total} users"))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.notifications import deliver_due_notifications, push_session, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Drains the push notification outbox to Expo, in batches over one keep-alive session.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Notifications per Expo request (max 100).')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling.')
+
+    def handle(self, *args, **options):
+        batch_size = min(options['batch_size'], BATCH_SIZE)
+        total = 0
+        with push_session() as session:
+            while True:
+                handled = deliver_due_notifications(session, batch_size)
+                total += handled
+                if handled:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Handled {total} notifications"))
@@ -0,0 +1,313 @@
+import heapq
+from collections import namedtuple
+
+import numpy as np
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, Value, When
+from django.db.models.functions import Greatest, Least, Lower
+
+from .interests import parse_interests, sync_interest_tags
+from .models import Match, UserPreferences
+
+# --- SCORING RULES ---
+CLEANLINESS_LEVELS = {'low': 1, 'medium': 2, 'high': 3}
+DEFAULT_CLEANLINESS = 2
+CITY_PENALTY = 50
+MIN_RECOMMENDATION_SCORE = 10
+
+
+def cleanliness_code(level):
+    return CLEANLINESS_LEVELS.get((level or '').lower(), DEFAULT_CLEANLINESS)
+
+
+def calculate_compatibility(user_prefs, candidate_prefs):
+    score = 0
+
+    # 1. Cleanliness (Weight: 30%)
+    diff = abs(cleanliness_code(user_prefs.cleanliness_level) - cleanliness_code(candidate_prefs.cleanliness_level))
+    if diff == 0: score += 30
+    elif diff == 1: score += 15
+
+    # 2. Smoking (Weight: 20%)
+    if user_prefs.smoking == candidate_prefs.smoking:
+        score += 20
+
+    # 3. Sleep Schedule (Weight: 20%)
+    if user_prefs.sleep_schedule == candidate_prefs.sleep_schedule:
+        score += 20
+
+    # 4. Guests (Weight: 15%)
+    if user_prefs.guests_allowed == candidate_prefs.guests_allowed:
+        score += 15
+
+    # 5. Pets (Weight: 10%)
+    if user_prefs.pets == candidate_prefs.pets:
+        score += 10
+
+    # 6. Interest Tags (Weight: 5%)
+    if parse_interests(user_prefs.other_interests) & parse_interests(candidate_prefs.other_interests):
+        score += 5
+
+    return score
+
+
+def calculate_match_score(user_prefs, candidate_prefs):
+    """
+    Final 0-100 score shown to users: compatibility minus the city penalty.
+    """
+    score = calculate_compatibility(user_prefs, candidate_prefs)
+
+    if user_prefs.city and candidate_prefs.city:
+        if user_prefs.city.lower() != candidate_prefs.city.lower():
+            score -= CITY_PENALTY
+
+    return max(0, min(100, score))
+
+
+# --- CANDIDATES ---
+def matched_with(user):
+    """
+    EXISTS condition for UserPreferences rows whose user already has a match
+    with `user`, in either direction.
+    """
+    return Exists(Match.objects.filter(
+        Q(user=user, matched_user=OuterRef('user')) |
+        Q(user=OuterRef('user'), matched_user=user)
+    ))
+
+
+def candidate_preferences(user):
+    """
+    Preferences of everyone `user` can be recommended, filtered in a single query:
+    same gender, no staff/admins, and nobody already matched in either direction.
+    """
+    return UserPreferences.objects.select_related('user').filter(
+        user__gender=user.gender,
+        user__is_staff=False,
+        user__is_superuser=False,
+    ).exclude(user=user).filter(~matched_with(user))
+
+
+# --- DATABASE SCORING ---
+def _points(condition, points):
+    return Case(When(condition, then=Value(points)), default=Value(0), output_field=IntegerField())
+
+
+def annotate_match_score(queryset, prefs):
+    """
+    Annotates `match_score` on a UserPreferences queryset, computing the same
+    0-100 score as `calculate_match_score` as one SQL CASE expression.
+    """
+    queryset = queryset.annotate(_cleanliness_lower=Lower('cleanliness_level')).annotate(
+        _cleanliness=Case(
+            *[When(_cleanliness_lower=level, then=Value(code)) for level, code in CLEANLINESS_LEVELS.items()],
+            default=Value(DEFAULT_CLEANLINESS),
+            output_field=IntegerField(),
+        ),
+    )
+    u_clean = cleanliness_code(prefs.cleanliness_level)
+
+    score = Case(
+        When(_cleanliness=u_clean, then=Value(30)),
+        When(_cleanliness__in=[u_clean - 1, u_clean + 1], then=Value(15)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    score += _points(Q(smoking=prefs.smoking), 20)
+    if prefs.sleep_schedule is None:
+        score += _points(Q(sleep_schedule__isnull=True), 20)
+    else:
+        score += _points(Q(sleep_schedule=prefs.sleep_schedule), 20)
+    score += _points(Q(guests_allowed=prefs.guests_allowed), 15)
+    score += _points(Q(pets=prefs.pets), 10)
+
+    tags = parse_interests(prefs.other_interests)
+    if tags:
+        # Uses the normalized tag table instead of re-parsing the text per row
+        queryset = queryset.annotate(_shares_interest=Exists(
+            UserPreferences.interest_tags.through.objects.filter(
+                userpreferences=OuterRef('pk'), interesttag__name__in=tags
+            )
+        ))
+        score += _points(Q(_shares_interest=True), 5)
+
+    if prefs.city:
+        queryset = queryset.annotate(_city_lower=Lower('city'))
+        score -= _points(Q(city__isnull=False) & ~Q(city='') & ~Q(_city_lower=prefs.city.lower()), CITY_PENALTY)
+
+    return queryset.annotate(match_score=Greatest(Value(0), Least(Value(100), score)))
+
+
+def top_matches_in_database(user, prefs, limit, after=None):
+    """
+    Scores and ranks every candidate in Postgres; only the top `limit` rows are fetched.
+    `after` is the (score, user_id) of the last row of the previous page.
+    """
+    queryset = annotate_match_score(candidate_preferences(user), prefs).filter(
+        match_score__gte=MIN_RECOMMENDATION_SCORE
+    )
+    if after:
+        score, user_id = after
+        queryset = queryset.filter(Q(match_score__lt=score) | Q(match_score=score, user_id__gt=user_id))
+    return queryset.order_by('-match_score', 'user_id')[:limit]
+
+
+# --- COMPACT FEATURES ---
+# UserPreferences.feature_vector layout:
+#   bits 0-1 cleanliness code (1-3), bit 2 smoking, bit 3 pets, bit 4 guests allowed
+# UserPreferences.interest_ids: sorted InterestTag ids
+# Sleep schedule and city are free text and stay in their own short columns.
+CLEANLINESS_MASK = 0b11
+SMOKING_BIT = 1 << 2
+PETS_BIT = 1 << 3
+GUESTS_BIT = 1 << 4
+
+
+def encode_features(prefs):
+    return (
+        cleanliness_code(prefs.cleanliness_level)
+        | (SMOKING_BIT if prefs.smoking else 0)
+        | (PETS_BIT if prefs.pets else 0)
+        | (GUESTS_BIT if prefs.guests_allowed else 0)
+    )
+
+
+def store_features(prefs, tag_ids):
+    """
+    Writes the compact encoding of `prefs` (its interest tags already synced).
+    """
+    prefs.feature_vector = encode_features(prefs)
+    prefs.interest_ids = sorted(tag_ids)
+    UserPreferences.objects.filter(pk=prefs.pk).update(
+        feature_vector=prefs.feature_vector, interest_ids=prefs.interest_ids
+    )
+
+
+def ensure_features(prefs):
+    if prefs.feature_vector is None or prefs.interest_ids is None:
+        store_features(prefs, sync_interest_tags(prefs))
+
+
+# --- BATCH SCORING ---
+# Just the compact columns the scorers read; cheap to load and to pickle
+PreferenceRow = namedtuple('PreferenceRow', ['user_id', 'feature_vector', 'interest_ids', 'sleep_schedule', 'city'])
+
+
+def load_preference_rows(queryset, *extra):
+    """
+    Loads the compact columns of a UserPreferences queryset, without building
+    model instances. Rows saved before the encoding existed are encoded first.
+    With `extra` field names, returns (row, extra_values) pairs instead.
+    """
+    values = list(queryset.values_list(*PreferenceRow._fields, *extra))
+
+    stale = [v[0] for v in values if v[1] is None or v[2] is None]
+    if stale:
+        for prefs in UserPreferences.objects.filter(user_id__in=stale):
+            ensure_features(prefs)
+        values = list(queryset.values_list(*PreferenceRow._fields, *extra))
+
+    size = len(PreferenceRow._fields)
+    rows = [PreferenceRow(*v[:size]) for v in values]
+    if extra:
+        return [(row, v[size:]) for row, v in zip(rows, values)]
+    return rows
+
+
+def _encode(values, vocabulary):
+    # Maps each value to a small integer code, growing the vocabulary as we go
+    return [vocabulary.setdefault(value, len(vocabulary)) for value in values]
+
+
+class PreferenceMatrix:
+    """
+    Column-oriented snapshot of many UserPreferences rows.
+
+    Every preference is stored once as an integer/boolean array, so a user can
+    be scored against all candidates in one vectorized pass instead of calling
+    `calculate_match_score` per pair. Scores are identical to the scalar path.
+    Rows only need the compact columns of `PreferenceRow`.
+    """
+
+    def __init__(self, preferences):
+        preferences = list(preferences)
+        self.preferences = preferences
+
+        self.user_ids = np.array([p.user_id for p in preferences], dtype=np.int64)
+
+        vectors = np.array([p.feature_vector for p in preferences], dtype=np.int32)
+        self.cleanliness = (vectors & CLEANLINESS_MASK).astype(np.int8)
+        self.smoking = (vectors & SMOKING_BIT) != 0
+        self.pets = (vectors & PETS_BIT) != 0
+        self.guests_allowed = (vectors & GUESTS_BIT) != 0
+
+        # Sleep schedule is free text, compared exactly (None included)
+        self.sleep_codes = {}
+        self.sleep = np.array(_encode((p.sleep_schedule for p in preferences), self.sleep_codes), dtype=np.int32)
+
+        # City is compared case-insensitively; -1 marks "no city" (never penalised)
+        self.city_codes = {}
+        self.city = np.array(
+            [self.city_codes.setdefault(p.city.lower(), len(self.city_codes)) if p.city else -1 for p in preferences],
+            dtype=np.int32,
+        )
+
+        # Interests as a tag -> rows inverted index (CSR layout): memory grows with
+        # the (user, tag) links, not with the size of the tag vocabulary
+        links = [(tag_id, row) for row, p in enumerate(preferences) for tag_id in p.interest_ids]
+        tags = np.array([tag_id for tag_id, _ in links], dtype=np.int64)
+        order = np.argsort(tags, kind='stable')
+        self.interest_tags, starts = np.unique(tags[order], return_index=True)
+        self.interest_starts = np.append(starts, len(links))
+        self.interest_rows = np.array([row for _, row in links], dtype=np.int32)[order]
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(load_preference_rows(queryset))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def score(self, prefs):
+        """
+        Returns an int array with the final 0-100 score of `prefs` against every row.
+        """
+        features = prefs.feature_vector
+        diff = np.abs(self.cleanliness - (features & CLEANLINESS_MASK))
+        score = np.where(diff == 0, 30, np.where(diff == 1, 15, 0)).astype(np.int32)
+
+        score += 20 * (self.smoking == bool(features & SMOKING_BIT))
+        score += 15 * (self.guests_allowed == bool(features & GUESTS_BIT))
+        score += 10 * (self.pets == bool(features & PETS_BIT))
+
+        sleep_code = self.sleep_codes.get(prefs.sleep_schedule)
+        if sleep_code is not None:
+            score += 20 * (self.sleep == sleep_code)
+
+        shared = np.zeros(len(self), dtype=bool)
+        tag_ids = np.asarray(prefs.interest_ids, dtype=np.int64)
+        positions = np.searchsorted(self.interest_tags, tag_ids)
+        for position, tag_id in zip(positions.tolist(), tag_ids.tolist()):
+            if position < len(self.interest_tags) and self.interest_tags[position] == tag_id:
+                shared[self.interest_rows[self.interest_starts[position]:self.interest_starts[position + 1]]] = True
+        score += 5 * shared
+
+        if prefs.city:
+            city_code = self.city_codes.get(prefs.city.lower(), -2)
+            score -= CITY_PENALTY * ((self.city != -1) & (self.city != city_code))
+
+        return np.clip(score, 0, 100)
+
+    def top_k(self, scores, limit, after=None):
+        """
+        Picks the `limit` best (score, row) pairs, ranked by score desc then user_id,
+        with a bounded heap instead of sorting every candidate.
+        `after` is the (score, user_id) of the last row of the previous page.
+        """
+        mask = scores >= MIN_RECOMMENDATION_SCORE
+        if after:
+            score, user_id = after
+            mask &= (scores < score) | ((scores == score) & (self.user_ids > user_id))
+
+        rows = np.flatnonzero(mask)
+        best = heapq.nsmallest(limit, zip((-scores[rows]).tolist(), self.user_ids[rows].tolist(), rows.tolist()))
+        return [(-neg_score, row) for neg_score, _, row in best]
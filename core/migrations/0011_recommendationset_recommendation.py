@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_userpreferences_is_actively_looking_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationSet',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation_set', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveIntegerField()),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'recommendation_sets',
+            },
+        ),
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('recommendation_id', models.AutoField(primary_key=True, serialize=False)),
+                ('compatibility_score', models.PositiveSmallIntegerField()),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_to', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'recommendations',
+                'indexes': [models.Index(fields=['user', '-compatibility_score', 'candidate'], name='recommendations_rank_idx')],
+                'unique_together': {('user', 'candidate')},
+            },
+        ),
+    ]
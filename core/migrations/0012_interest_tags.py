@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recommendationset_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterestTag',
+            fields=[
+                ('tag_id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.TextField(unique=True)),
+            ],
+            options={
+                'db_table': 'interest_tags',
+            },
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='interest_tags',
+            field=models.ManyToManyField(blank=True, db_table='user_interest_tags', related_name='preferences', to='core.interesttag'),
+        ),
+    ]
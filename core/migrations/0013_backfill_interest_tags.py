@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def backfill_interest_tags(apps, schema_editor):
+    UserPreferences = apps.get_model('core', 'UserPreferences')
+    InterestTag = apps.get_model('core', 'InterestTag')
+    Through = UserPreferences.interest_tags.through
+
+    tag_ids = {}
+    links = []
+    for prefs_id, text in UserPreferences.objects.exclude(other_interests=None).values_list('preference_id', 'other_interests').iterator():
+        names = set(x.strip().lower() for x in text.split(',')) - {''}
+        for name in names:
+            if name not in tag_ids:
+                tag_ids[name] = InterestTag.objects.get_or_create(name=name)[0].tag_id
+            links.append(Through(userpreferences_id=prefs_id, interesttag_id=tag_ids[name]))
+
+    Through.objects.bulk_create(links, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_interest_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_interest_tags, migrations.RunPython.noop),
+    ]
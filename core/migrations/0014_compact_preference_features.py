@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:09
+
+from django.db import migrations, models
+
+# Mirrors core.matching.encode_features / encode_interest_bits at the time of writing
+CLEANLINESS_LEVELS = {'low': 1, 'medium': 2, 'high': 3}
+
+
+def backfill_features(apps, schema_editor):
+    UserPreferences = apps.get_model('core', 'UserPreferences')
+    Through = UserPreferences.interest_tags.through
+
+    tags = {}
+    for prefs_id, tag_id in Through.objects.values_list('userpreferences_id', 'interesttag_id').iterator():
+        tags.setdefault(prefs_id, []).append(tag_id)
+
+    batch = []
+    for prefs in UserPreferences.objects.all().iterator():
+        prefs.feature_vector = (
+            CLEANLINESS_LEVELS.get((prefs.cleanliness_level or '').lower(), 2)
+            | (4 if prefs.smoking else 0)
+            | (8 if prefs.pets else 0)
+            | (16 if prefs.guests_allowed else 0)
+        )
+        bits = 0
+        for tag_id in tags.get(prefs.preference_id, ()):
+            bits |= 1 << tag_id
+        prefs.interest_bits = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        batch.append(prefs)
+        if len(batch) >= 1000:
+            UserPreferences.objects.bulk_update(batch, ['feature_vector', 'interest_bits'])
+            batch = []
+    UserPreferences.objects.bulk_update(batch, ['feature_vector', 'interest_bits'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_backfill_interest_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpreferences',
+            name='feature_vector',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='interest_bits',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(backfill_features, migrations.RunPython.noop),
+    ]
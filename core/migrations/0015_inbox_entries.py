@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_compact_preference_features'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('inbox_entry_id', models.AutoField(primary_key=True, serialize=False)),
+                ('last_message_text', models.TextField(null=True)),
+                ('last_message_at', models.DateTimeField(null=True)),
+                ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='core.conversation')),
+                ('last_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message')),
+                ('other_participant', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'inbox_entries',
+                'indexes': [models.Index(fields=['user', '-last_activity_at'], name='inbox_entries_activity_idx')],
+                'unique_together': {('user', 'conversation')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+
+
+def backfill_inbox_entries(apps, schema_editor):
+    Conversation = apps.get_model('core', 'Conversation')
+    Message = apps.get_model('core', 'Message')
+    InboxEntry = apps.get_model('core', 'InboxEntry')
+    Through = Conversation.participants.through
+
+    participants = defaultdict(list)
+    for conversation_id, user_id in Through.objects.order_by('id').values_list('conversation_id', 'user_id').iterator():
+        participants[conversation_id].append(user_id)
+
+    # Unread = not read and sent by someone else, counted per (conversation, sender)
+    unread_by_sender = defaultdict(dict)
+    for conversation_id, sender_id, count in Message.objects.filter(is_read=False).values_list(
+        'conversation_id', 'sender_id'
+    ).annotate(count=Count('message_id')).order_by():
+        unread_by_sender[conversation_id][sender_id] = count
+
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-sent_at', '-message_id')
+    conversations = Conversation.objects.annotate(
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+        last_message_text=Subquery(latest.values('message_text')[:1]),
+        last_message_at=Subquery(latest.values('sent_at')[:1]),
+    ).values_list('conversation_id', 'created_at', 'last_message_id', 'last_message_text', 'last_message_at')
+
+    entries = []
+    for conversation_id, created_at, message_id, text, sent_at in conversations.iterator():
+        users = participants.get(conversation_id, [])
+        unread = unread_by_sender.get(conversation_id, {})
+        for user_id in users:
+            entries.append(InboxEntry(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                other_participant_id=next((other for other in users if other != user_id), None),
+                last_message_id=message_id,
+                last_message_text=text,
+                last_message_at=sent_at,
+                last_activity_at=sent_at or created_at,
+                unread_count=sum(count for sender_id, count in unread.items() if sender_id != user_id),
+            ))
+    InboxEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_inbox_entries'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_inbox_entries, migrations.RunPython.noop),
+    ]
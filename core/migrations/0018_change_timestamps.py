@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:22
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_change_timestamps(apps, schema_editor):
+    # Existing rows last changed when they were last active, not at migration time
+    apps.get_model('core', 'Message').objects.update(updated_at=F('sent_at'))
+    apps.get_model('core', 'InboxEntry').objects.update(updated_at=F('last_activity_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='inboxentry',
+            index=models.Index(fields=['user', 'updated_at'], name='inbox_entries_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['updated_at', 'message_id'], name='messages_changes_idx'),
+        ),
+        migrations.RunPython(backfill_change_timestamps, migrations.RunPython.noop),
+    ]
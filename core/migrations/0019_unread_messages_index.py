@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_change_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['conversation', 'sender', 'message_id'], name='messages_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def dedupe_direct_conversations(apps, schema_editor):
+    Conversation = apps.get_model('core', 'Conversation')
+    Message = apps.get_model('core', 'Message')
+    InboxEntry = apps.get_model('core', 'InboxEntry')
+    Through = Conversation.participants.through
+
+    participants = defaultdict(set)
+    for conversation_id, user_id in Through.objects.values_list('conversation_id', 'user_id').iterator():
+        participants[conversation_id].add(user_id)
+
+    by_pair = defaultdict(list)
+    for conversation_id, users in participants.items():
+        if len(users) == 2:
+            by_pair[tuple(sorted(users))].append(conversation_id)
+
+    now = timezone.now()
+    keepers = []
+    for (low, high), conversation_ids in by_pair.items():
+        # The oldest chat of a pair absorbs the messages of the others
+        keeper, *duplicates = sorted(conversation_ids)
+        keepers.append(Conversation(conversation_id=keeper, user_low_id=low, user_high_id=high))
+        if not duplicates:
+            continue
+
+        Message.objects.filter(conversation_id__in=duplicates).update(conversation_id=keeper, updated_at=now)
+        Conversation.objects.filter(conversation_id__in=duplicates).delete()
+
+        last = Message.objects.filter(conversation_id=keeper).order_by('-sent_at', '-message_id').first()
+        for user_id, other_id in [(low, high), (high, low)]:
+            InboxEntry.objects.update_or_create(
+                user_id=user_id, conversation_id=keeper,
+                defaults={
+                    'other_participant_id': other_id,
+                    'last_message': last,
+                    'last_message_text': last.message_text if last else None,
+                    'last_message_at': last.sent_at if last else None,
+                    'last_activity_at': last.sent_at if last else now,
+                    'unread_count': Message.objects.filter(
+                        conversation_id=keeper, is_read=False
+                    ).exclude(sender_id=user_id).count(),
+                    'updated_at': now,
+                },
+            )
+
+    Conversation.objects.bulk_update(keepers, ['user_low', 'user_high'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_conversation_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_direct_conversations, migrations.RunPython.noop),
+    ]
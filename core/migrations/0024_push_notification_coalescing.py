@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_push_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='conversation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.conversation'),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='message_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(fields=['recipient', 'conversation', '-created_at'], name='push_notifications_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomlisting',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('title', config='simple', weight='A'), '||', django.contrib.postgres.search.SearchVector('city', 'area', config='simple', weight='B'), django.contrib.postgres.search.SearchConfig('simple')), '||', django.contrib.postgres.search.SearchVector('description', config='simple', weight='C'), django.contrib.postgres.search.SearchConfig('simple')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='roomlisting',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='room_listings_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomlisting',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at', '-listing_id'], name='room_listings_active_idx'),
+        ),
+    ]
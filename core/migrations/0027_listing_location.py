@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_listing_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomlisting',
+            name='geohash',
+            field=models.CharField(db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='roomlisting',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='roomlisting',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:32
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_listing_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='roomlisting',
+            index=models.Index(django.db.models.functions.text.Upper('city'), models.F('room_type'), models.F('rent_amount'), condition=models.Q(('is_active', True)), name='room_listings_city_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomlisting',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['room_type', 'rent_amount'], name='room_listings_type_filter_idx'),
+        ),
+    ]
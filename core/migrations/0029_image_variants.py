@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_listing_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='listingimage',
+            name='variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userverification',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='userverification',
+            name='variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='listingimage',
+            index=models.Index(condition=models.Q(('processing_status', 'pending')), fields=['image_id'], name='listing_images_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userverification',
+            index=models.Index(condition=models.Q(('processing_status', 'pending')), fields=['verification_id'], name='user_verifications_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationset',
+            name='cutoff_candidate',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='recommendationset',
+            name='cutoff_score',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def backfill_interest_ids(apps, schema_editor):
+    UserPreferences = apps.get_model('core', 'UserPreferences')
+    Through = UserPreferences.interest_tags.through
+
+    tags = {}
+    for prefs_id, tag_id in Through.objects.values_list('userpreferences_id', 'interesttag_id').iterator():
+        tags.setdefault(prefs_id, []).append(tag_id)
+
+    batch = []
+    for prefs in UserPreferences.objects.only('preference_id').iterator():
+        prefs.interest_ids = sorted(tags.get(prefs.preference_id, ()))
+        batch.append(prefs)
+        if len(batch) >= 1000:
+            UserPreferences.objects.bulk_update(batch, ['interest_ids'])
+            batch = []
+    UserPreferences.objects.bulk_update(batch, ['interest_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_recommendation_cutoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpreferences',
+            name='interest_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), editable=False, null=True, size=None),
+        ),
+        migrations.RunPython(backfill_interest_ids, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userpreferences',
+            name='interest_bits',
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:53
+
+from django.db import migrations, models
+
+# Stamps each written row with the id of the writing transaction. Unlike a
+# timestamp or a sequence value, it lets sync tell which writes may still be
+# in flight: every transaction older than the snapshot's xmin has finished.
+CHANGE_XID_TRIGGERS = '''
+CREATE FUNCTION record_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER messages_change_xid BEFORE INSERT OR UPDATE ON messages
+    FOR EACH ROW EXECUTE FUNCTION record_change_xid();
+CREATE TRIGGER inbox_entries_change_xid BEFORE INSERT OR UPDATE ON inbox_entries
+    FOR EACH ROW EXECUTE FUNCTION record_change_xid();
+'''
+
+DROP_CHANGE_XID_TRIGGERS = '''
+DROP TRIGGER inbox_entries_change_xid ON inbox_entries;
+DROP TRIGGER messages_change_xid ON messages;
+DROP FUNCTION record_change_xid();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_interest_ids'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='inboxentry',
+            name='inbox_entries_changes_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_changes_idx',
+        ),
+        migrations.RemoveField(
+            model_name='inboxentry',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='updated_at',
+        ),
+        migrations.AddField(
+            model_name='inboxentry',
+            name='change_xid',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='change_xid',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='inboxentry',
+            index=models.Index(fields=['user', 'change_xid'], name='inbox_entries_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['change_xid', 'message_id'], name='messages_changes_idx'),
+        ),
+        migrations.RunSQL(CHANGE_XID_TRIGGERS, DROP_CHANGE_XID_TRIGGERS),
+    ]
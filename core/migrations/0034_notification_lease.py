@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_change_xid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='lease_until',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(condition=models.Q(('status', 'sending')), fields=['lease_until'], name='push_notifications_lease_idx'),
+        ),
+    ]
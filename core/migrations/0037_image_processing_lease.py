@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_keep_conversations_of_deleted_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingimage',
+            name='lease_until',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userverification',
+            name='lease_until',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='listingimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='userverification',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='listingimage',
+            index=models.Index(condition=models.Q(('processing_status', 'processing')), fields=['lease_until'], name='listing_images_lease_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userverification',
+            index=models.Index(condition=models.Q(('processing_status', 'processing')), fields=['lease_until'], name='user_verifications_lease_idx'),
+        ),
+    ]
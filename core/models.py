@@ -1,5 +1,12 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 # --- 1. MANAGERS ---
@@ -40,6 +47,12 @@ class RoomType(models.TextChoices):
     PRIVATE = 'private', 'Private'
     SHARED = 'shared', 'Shared'
     BEDSITTER = 'bedsitter', 'Bedsitter'
+
+class ImageStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    PROCESSING = 'processing', 'Processing'
+    READY = 'ready', 'Ready'
+    FAILED = 'failed', 'Failed'
 # --- 3. MODELS ---
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -85,9 +98,23 @@ class UserPreferences(models.Model):
     target_city = models.CharField(max_length=100, blank=True)
     move_in_date = models.DateField(null=True, blank=True)
 
+    # Normalized copy of `other_interests`, kept in sync on save
+    interest_tags = models.ManyToManyField('InterestTag', related_name='preferences', blank=True, db_table='user_interest_tags')
+
+    # Compact encoding read by the recommendation engine (see core/matching.py)
+    feature_vector = models.IntegerField(null=True, editable=False)
+    interest_ids = ArrayField(models.IntegerField(), null=True, editable=False)
+
     class Meta:
         db_table = 'user_preferences'
 
+class InterestTag(models.Model):
+    tag_id = models.AutoField(primary_key=True)
+    name = models.TextField(unique=True) # lowercased, trimmed
+
+    class Meta:
+        db_table = 'interest_tags'
+
 
 class UserVerification(models.Model):
     verification_id = models.AutoField(primary_key=True)
@@ -101,9 +128,18 @@ class UserVerification(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
     verified_at = models.DateTimeField(null=True, blank=True)
     rejection_reason = models.TextField(null=True, blank=True)
+    # Resized, EXIF-free copies made by the process_images worker: {name: {format: path}}
+    variants = models.JSONField(default=dict, editable=False)
+    processing_status = models.CharField(max_length=10, default=ImageStatus.PENDING, choices=ImageStatus.choices, editable=False)
+    # While 'processing': the claiming worker's deadline, after which another may retry it
+    lease_until = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         db_table = 'user_verifications'        
+        indexes = [
+            models.Index(fields=['verification_id'], condition=models.Q(processing_status='pending'), name='user_verifications_pending_idx'),
+            models.Index(fields=['lease_until'], condition=models.Q(processing_status='processing'), name='user_verifications_lease_idx'),
+        ]
 
 class RoomListing(models.Model):
     listing_id = models.AutoField(primary_key=True)
@@ -112,15 +148,43 @@ class RoomListing(models.Model):
     description = models.TextField()
     city = models.CharField(max_length=50)
     area = models.CharField(max_length=100, null=True)
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    # Derived from latitude/longitude on save; "near me" searches scan prefixes of it
+    geohash = models.CharField(max_length=12, null=True, editable=False, db_index=True)
     rent_amount = models.DecimalField(max_digits=10, decimal_places=2)
     deposit_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     room_type = models.CharField(max_length=20, choices=RoomType.choices)
     available_from = models.DateField(null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now)
+    # Maintained by Postgres: title ranks above location, location above description
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config='simple')
+            + SearchVector('city', 'area', weight='B', config='simple')
+            + SearchVector('description', weight='C', config='simple')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     class Meta:
         db_table = 'room_listings'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='room_listings_search_idx'),
+            # Newest-first keyset pages of the active catalogue
+            models.Index(
+                fields=['-created_at', '-listing_id'], condition=models.Q(is_active=True), name='room_listings_active_idx'
+            ),
+            # Filter screen: city (matched case-insensitively) then room type then rent range, or without the city
+            models.Index(
+                Upper('city'), 'room_type', 'rent_amount', condition=models.Q(is_active=True), name='room_listings_city_filter_idx'
+            ),
+            models.Index(
+                fields=['room_type', 'rent_amount'], condition=models.Q(is_active=True), name='room_listings_type_filter_idx'
+            ),
+        ]
 
 class ListingImage(models.Model):
     image_id = models.AutoField(primary_key=True)
@@ -128,9 +192,18 @@ class ListingImage(models.Model):
     # 👇 CHANGE: Use ImageField for real file uploads
     image_file = models.ImageField(upload_to='room_photos/') 
     uploaded_at = models.DateTimeField(default=timezone.now)
+    # Resized, EXIF-free copies made by the process_images worker: {name: {format: path}}
+    variants = models.JSONField(default=dict, editable=False)
+    processing_status = models.CharField(max_length=10, default=ImageStatus.PENDING, choices=ImageStatus.choices, editable=False)
+    # While 'processing': the claiming worker's deadline, after which another may retry it
+    lease_until = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         db_table = 'listing_images'
+        indexes = [
+            models.Index(fields=['image_id'], condition=models.Q(processing_status='pending'), name='listing_images_pending_idx'),
+            models.Index(fields=['lease_until'], condition=models.Q(processing_status='processing'), name='listing_images_lease_idx'),
+        ]
 
 class Match(models.Model):
     match_id = models.AutoField(primary_key=True)
@@ -147,12 +220,19 @@ class Match(models.Model):
 class Conversation(models.Model):
     conversation_id = models.AutoField(primary_key=True)
     participants = models.ManyToManyField(User, related_name='conversations')
+    # Canonical pair of a direct conversation (lower user id first), unique per pair.
+    # A deleted account only leaves its side empty: the other keeps the history
+    user_low = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) 
 
     class Meta:
         db_table = 'conversations'
         ordering = ['-updated_at'] 
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='conversations_pair_unique'),
+        ]
 
 class Message(models.Model):
     message_id = models.AutoField(primary_key=True)
@@ -161,10 +241,109 @@ class Message(models.Model):
     message_text = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # Id of the last transaction that wrote the row (including read state), set by
+    # a trigger; drives the delta sync
+    change_xid = models.BigIntegerField(null=True, editable=False)
+    # Maintained by Postgres on every write. 'simple': chats mix English and Swahili, so no stemming
+    search_vector = models.GeneratedField(
+        expression=SearchVector('message_text', config='simple'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     class Meta:
         db_table = 'messages'
         ordering = ['sent_at']
+        indexes = [
+            # Keyset pagination of a conversation's history, in both directions
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='messages_history_idx'),
+            models.Index(fields=['change_xid', 'message_id'], name='messages_changes_idx'),
+            GinIndex(fields=['search_vector'], name='messages_search_idx'),
+            # Only unread rows: keeps unread counts and mark_read cheap however long the history
+            models.Index(
+                fields=['conversation', 'sender', 'message_id'],
+                condition=models.Q(is_read=False),
+                name='messages_unread_idx',
+            ),
+        ]
+
+class InboxEntry(models.Model):
+    # One row per participant and conversation, kept current as messages are sent,
+    # so the inbox is a single indexed read
+    inbox_entry_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='inbox_entries')
+    other_participant = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_message_text = models.TextField(null=True)
+    last_message_at = models.DateTimeField(null=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Same trigger as Message.change_xid
+    change_xid = models.BigIntegerField(null=True, editable=False)
+
+    class Meta:
+        db_table = 'inbox_entries'
+        unique_together = ('user', 'conversation')
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at'], name='inbox_entries_activity_idx'),
+            models.Index(fields=['user', 'change_xid'], name='inbox_entries_changes_idx'),
+        ]
+
+class PushNotification(models.Model):
+    # Outbox: written with the event that triggers it, delivered by the send_notifications worker
+    PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+
+    notification_id = models.AutoField(primary_key=True)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='push_notifications')
+    # Set for chat pushes: a burst in one conversation is coalesced into one row
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, null=True, related_name='+')
+    message_count = models.PositiveIntegerField(default=1)
+    token = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # While 'sending': the claiming worker's deadline, after which another may retry it
+    lease_until = models.DateTimeField(null=True)
+    last_error = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'push_notifications'
+        indexes = [
+            # The worker only ever scans what is still due
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='push_notifications_due_idx'),
+            models.Index(fields=['lease_until'], condition=models.Q(status='sending'), name='push_notifications_lease_idx'),
+            models.Index(fields=['recipient', 'conversation', '-created_at'], name='push_notifications_recent_idx'),
+        ]
+
+class UploadSession(models.Model):
+    # A resumable upload: chunks are appended to a temp file, which becomes a
+    # ListingImage or UserVerification on finalize
+    LISTING_IMAGE, VERIFICATION = 'listing_image', 'verification'
+    KIND_CHOICES = [(LISTING_IMAGE, 'Listing image'), (VERIFICATION, 'Verification document')]
+    OPEN, COMPLETE = 'open', 'complete'
+
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    listing = models.ForeignKey(RoomListing, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    document_type = models.CharField(max_length=50, default='national_id')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    received = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, default=OPEN)
+    listing_image = models.ForeignKey(ListingImage, on_delete=models.SET_NULL, null=True, related_name='+')
+    verification = models.ForeignKey(UserVerification, on_delete=models.SET_NULL, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'upload_sessions'
 
 class Payment(models.Model):
     payment_id = models.AutoField(primary_key=True)
@@ -189,4 +368,42 @@ class Review(models.Model):
 
     class Meta:
         db_table = 'reviews'
-        unique_together = ('reviewer', 'reviewed_user')
\ No newline at end of file
+        unique_together = ('reviewer', 'reviewed_user')
+
+class RecommendationSet(models.Model):
+    # Freshness marker for a user's stored recommendations
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='recommendation_set')
+    version = models.PositiveIntegerField()
+    refreshed_at = models.DateTimeField(default=timezone.now)
+    # Only the top RECOMMENDATION_STORE_LIMIT candidates are stored: every candidate
+    # ranked at or before (cutoff_score, cutoff_candidate) is. Null when all are.
+    cutoff_score = models.PositiveSmallIntegerField(null=True)
+    cutoff_candidate = models.IntegerField(null=True)
+
+    class Meta:
+        db_table = 'recommendation_sets'
+
+class RecommendationRefresh(models.Model):
+    # Users whose stored rows are out of date after a change, drained by the
+    # refresh_recommendations worker. One row per user: repeated saves share it
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    requested_at = models.DateTimeField(default=timezone.now)
+    # Set while a worker refreshes the user; past it, another may take over
+    lease_until = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'recommendation_refreshes'
+
+class Recommendation(models.Model):
+    recommendation_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    candidate = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommended_to')
+    compatibility_score = models.PositiveSmallIntegerField()
+
+    class Meta:
+        db_table = 'recommendations'
+        unique_together = ('user', 'candidate')
+        indexes = [
+            # Serves the keyset-paginated read: WHERE user = ? ORDER BY score DESC, candidate
+            models.Index(fields=['user', '-compatibility_score', 'candidate'], name='recommendations_rank_idx'),
+        ]
@@ -1,30 +1,202 @@
+from collections import Counter
+from datetime import timedelta
+
 import requests
-import json
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import PushNotification, User
+
+# Expo accepts at most 100 messages per request
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_BASE = timedelta(seconds=30)
+REQUEST_TIMEOUT = 10
+# How long a claimed batch stays with its worker; past it, a crashed worker's rows are sent again
+LEASE = timedelta(minutes=2)
+# Expo errors that retrying will not fix
+PERMANENT_ERRORS = {'DeviceNotRegistered', 'InvalidCredentials', 'MessageTooBig'}
+RATE_PERIOD = timedelta(minutes=1)
+
+
+def queue_push_notification(recipient, title, body, data=None):
+    """
+    Adds a push notification to the outbox. Call it inside the transaction of
+    the triggering write: it is only delivered if that write commits.
+    """
+    if not recipient.expo_push_token:
+        return None  # User has no token, skip
+    return PushNotification.objects.create(
+        recipient=recipient, token=recipient.expo_push_token, title=title, body=body, data=data or {}
+    )
+
 
-def send_push_notification(token, title, body, data=None):
+def queue_message_notification(recipient, message):
     """
-    Sends a push notification to a specific Expo push token.
+    Queues the push for a new chat message, coalescing bursts: a push still
+    waiting for the same recipient and conversation absorbs it ("3 new messages
+    from X"), and one following a push queued less than PUSH_COALESCE_SECONDS
+    ago is held until that window ends, so the rest of the burst can join it.
     """
-    if not token:
-        return # User has no token, skip
+    if not recipient.expo_push_token:
+        return None
+    sender = message.sender.full_name
+    earlier = PushNotification.objects.filter(recipient=recipient, conversation_id=message.conversation_id)
+
+    # Never waits: a worker claims rows out of 'pending' before sending them, and a
+    # row locked by a concurrent send in the same conversation is left to it
+    pending = earlier.select_for_update(skip_locked=True).filter(
+        status=PushNotification.PENDING
+    ).order_by('-created_at').first()
+    if pending:
+        pending.message_count += 1
+        pending.title = f"{pending.message_count} new messages from {sender}"
+        pending.body = message.message_text
+        pending.token = recipient.expo_push_token
+        pending.save(update_fields=['message_count', 'title', 'body', 'token'])
+        return pending
+
+    now = timezone.now()
+    last = earlier.order_by('-created_at').values_list('created_at', flat=True).first()
+    window = timedelta(seconds=settings.PUSH_COALESCE_SECONDS)
+    return PushNotification.objects.create(
+        recipient=recipient,
+        conversation_id=message.conversation_id,
+        token=recipient.expo_push_token,
+        title=f"New message from {sender}",
+        body=message.message_text,
+        data={"conversation_id": message.conversation_id},
+        next_attempt_at=max(now, last + window) if last else now,
+    )
+
+
+def _apply_rate_cap(batch, now):
+    """
+    Splits off the notifications that would push a recipient past
+    PUSH_RATE_LIMIT sends per minute.
+    """
+    sent = Counter(dict(PushNotification.objects.filter(
+        Q(status=PushNotification.SENT, sent_at__gte=now - RATE_PERIOD)
+        # Being sent by other workers right now
+        | Q(status=PushNotification.SENDING, lease_until__gte=now),
+        recipient_id__in={n.recipient_id for n in batch},
+    ).values_list('recipient_id').annotate(n=Count('notification_id')).order_by()))
+
+    allowed, deferred = [], []
+    for notification in batch:
+        if sent[notification.recipient_id] < settings.PUSH_RATE_LIMIT:
+            sent[notification.recipient_id] += 1
+            allowed.append(notification)
+        else:
+            deferred.append(notification)
+    return allowed, deferred
+
 
-    url = "https://exp.host/--/api/v2/push/send"
-    headers = {
+def push_session():
+    """
+    Keep-alive session reused for every batch of a worker.
+    """
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=0))
+    session.mount('http://', HTTPAdapter(pool_maxsize=4, max_retries=0))
+    session.headers.update({
         "Content-Type": "application/json",
         "Accept": "application/json",
-    }
-    
-    payload = {
-        "to": token,
-        "title": title,
-        "body": body,
-        "sound": "default",
-        "data": data or {}, # Optional data payload (e.g., to open a specific chat)
-    }
+        "Accept-Encoding": "gzip, deflate",
+    })
+    return session
+
+
+def _retry(notification, error, now):
+    notification.attempts += 1
+    notification.last_error = error
+    if notification.attempts >= MAX_ATTEMPTS:
+        notification.status = PushNotification.FAILED
+    else:
+        # Exponential backoff: 30s, 1m, 2m, 4m...
+        notification.status = PushNotification.PENDING
+        notification.next_attempt_at = now + RETRY_BASE * 2 ** (notification.attempts - 1)
+
+
+def _claim(batch_size):
+    """
+    Claims up to `batch_size` due notifications, plus any whose lease ran out,
+    by moving them to 'sending' under a fresh lease, in one short transaction.
+    Rows are locked with SKIP LOCKED, so several workers can claim side by side.
+    Returns (claimed, deferred count, lease).
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        batch = list(PushNotification.objects.select_for_update(skip_locked=True).filter(
+            Q(status=PushNotification.PENDING, next_attempt_at__lte=now)
+            | Q(status=PushNotification.SENDING, lease_until__lt=now)
+        ).order_by('next_attempt_at')[:batch_size])
 
+        batch, deferred = _apply_rate_cap(batch, now)
+        for notification in deferred:
+            # Not an attempt: only postponed, and still open to coalescing
+            notification.status, notification.lease_until = PushNotification.PENDING, None
+            notification.next_attempt_at = now + RATE_PERIOD
+        lease = now + LEASE
+        for notification in batch:
+            notification.status, notification.lease_until = PushNotification.SENDING, lease
+        PushNotification.objects.bulk_update(batch + deferred, ['status', 'lease_until', 'next_attempt_at'])
+    return batch, len(deferred), lease
+
+
+def deliver_due_notifications(session, batch_size=BATCH_SIZE):
+    """
+    Sends one batch of due notifications in a single Expo request and records
+    the outcome of each. No transaction or row lock is held during the request:
+    rows are claimed first and the results written afterwards, so queueing a
+    message never waits on Expo. Returns the number of rows handled.
+    """
+    batch, deferred, lease = _claim(batch_size)
+    if not batch:
+        return deferred
+
+    payload = [
+        {"to": n.token, "title": n.title, "body": n.body, "sound": "default", "data": n.data}
+        for n in batch
+    ]
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = session.post(settings.EXPO_PUSH_URL, json=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        print(f"✅ Notification sent to {token}")
-    except Exception as e:
-        print(f"❌ Failed to send notification: {e}")
\ No newline at end of file
+        tickets = response.json()['data']
+        if len(tickets) != len(batch):
+            raise ValueError(f"Expected {len(batch)} tickets, got {len(tickets)}")
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        tickets = [{"status": "error", "message": str(e)}] * len(batch)
+
+    now = timezone.now()
+    dead_tokens = set()
+    for notification, ticket in zip(batch, tickets):
+        notification.lease_until = None
+        if ticket.get('status') == 'ok':
+            notification.status, notification.sent_at = PushNotification.SENT, now
+            continue
+        error = (ticket.get('details') or {}).get('error')
+        if error in PERMANENT_ERRORS:
+            notification.status, notification.last_error = PushNotification.FAILED, error
+            notification.attempts += 1
+            if error == 'DeviceNotRegistered':
+                dead_tokens.add(notification.token)
+        else:
+            _retry(notification, ticket.get('message') or error or 'Unknown error', now)
+
+    with transaction.atomic():
+        # Rows whose lease ran out meanwhile belong to whichever worker claimed them again
+        held = set(PushNotification.objects.select_for_update().filter(
+            pk__in=[n.pk for n in batch], status=PushNotification.SENDING, lease_until=lease
+        ).values_list('pk', flat=True))
+        PushNotification.objects.bulk_update(
+            [n for n in batch if n.pk in held],
+            ['status', 'attempts', 'next_attempt_at', 'lease_until', 'last_error', 'sent_at'],
+        )
+        if dead_tokens:
+            # The app was uninstalled: stop queueing for these devices
+            User.objects.filter(expo_push_token__in=dead_tokens).update(expo_push_token=None)
+    return len(batch) + deferred
@@ -0,0 +1,41 @@
+import base64
+import binascii
+
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def encode_cursor(*values):
+    """
+    Opaque cursor for keyset pagination, e.g. encode_cursor(score, user_id).
+    """
+    raw = '|'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token, *types):
+    """
+    Reverses `encode_cursor`, converting each part with the matching type.
+    """
+    try:
+        parts = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        if len(parts) != len(types):
+            raise ValueError
+        return tuple(cast(part) for cast, part in zip(types, parts))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def parse_limit(request, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    value = request.query_params.get('limit')
+    if not value:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    if limit < 1:
+        raise ValidationError({'limit': 'Must be at least 1.'})
+    return min(limit, maximum)
@@ -0,0 +1,289 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .matching import (
+    candidate_preferences, ensure_features, load_preference_rows, matched_with,
+    PreferenceMatrix, MIN_RECOMMENDATION_SCORE
+)
+from .models import Recommendation, RecommendationRefresh, RecommendationSet, User, UserPreferences
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the scoring rules (or what is stored) change: every stored set is rebuilt on next read
+SCORING_VERSION = 2
+REFRESH_BATCH_SIZE = 20
+# How long a claimed refresh stays with its worker; past it, a crashed worker's users are retried
+REFRESH_LEASE = timedelta(minutes=5)
+
+
+def _rows(user_id, scored):
+    return [
+        Recommendation(user_id=user_id, candidate_id=candidate_id, compatibility_score=score)
+        for candidate_id, score in scored
+        if score >= MIN_RECOMMENDATION_SCORE
+    ]
+
+
+def top_candidates(matrix, scores, limit=None):
+    """
+    The best `limit` (default RECOMMENDATION_STORE_LIMIT) (candidate_id, score)
+    pairs of `scores` over `matrix`, and the cutoff to store with them: the
+    (score, candidate_id) of the last one when others were left out, else None.
+    """
+    limit = limit or settings.RECOMMENDATION_STORE_LIMIT
+    top = [(int(matrix.user_ids[row]), score) for score, row in matrix.top_k(scores, limit + 1)]
+    if len(top) <= limit:
+        return top, None
+    candidate_id, score = top[limit - 1]
+    return top[:limit], (score, candidate_id)
+
+
+def _rank(score, candidate_id):
+    # Sort key of the ranking: score desc, then candidate id
+    return (-score, candidate_id)
+
+
+def _upsert(rows):
+    # Refreshes hold the newest scores: they overwrite what a concurrent build
+    # wrote. Key order keeps two writers from deadlocking.
+    Recommendation.objects.bulk_create(
+        sorted(rows, key=lambda r: (r.user_id, r.candidate_id)), batch_size=1000, update_conflicts=True,
+        unique_fields=['user', 'candidate'], update_fields=['compatibility_score'],
+    )
+
+
+def build_recommendations(user, prefs, only_if_stale=False):
+    """
+    Recomputes and stores the full recommendation set of one user.
+
+    Builds of one user are serialized on its RecommendationSet row, so two
+    concurrent first loads queue up instead of colliding on the (user,
+    candidate) constraint. With `only_if_stale` the later one finds the set
+    current and returns.
+    """
+    ensure_features(prefs)
+    # Committed before any candidate is read: from here on, refreshes after
+    # other users' preference saves write their new scores into this set themselves
+    RecommendationSet.objects.get_or_create(user=user, defaults={'version': 0})
+
+    with transaction.atomic():
+        marker = RecommendationSet.objects.select_for_update().get(user=user)
+        if only_if_stale and marker.version == SCORING_VERSION:
+            return marker
+
+        candidates = PreferenceMatrix.from_queryset(candidate_preferences(user))
+        top, cutoff = top_candidates(candidates, candidates.score(prefs))
+        Recommendation.objects.filter(user=user).delete()
+        # A row already there came from such a save and is newer than ours
+        Recommendation.objects.bulk_create(_rows(user.user_id, top), batch_size=1000, ignore_conflicts=True)
+        marker.version, marker.refreshed_at = SCORING_VERSION, timezone.now()
+        marker.cutoff_score, marker.cutoff_candidate = cutoff or (None, None)
+        marker.save()
+    return marker
+
+
+def ensure_recommendations(user, prefs):
+    """
+    Builds the stored set on first use, or when the scoring rules changed since.
+    Returns its RecommendationSet.
+    """
+    marker = RecommendationSet.objects.filter(user=user, version=SCORING_VERSION).first()
+    return marker or build_recommendations(user, prefs, only_if_stale=True)
+
+
+def live_recommendations(user, prefs, limit, after=None):
+    """
+    Scores every candidate of `user` in one vectorized pass and returns the best
+    `limit` ranked after `after` (a (score, user_id) pair) as (User, score) pairs.
+    Only the compact feature columns are loaded, full users only for the page.
+    """
+    ensure_features(prefs)
+    matrix = PreferenceMatrix.from_queryset(candidate_preferences(user))
+    top = [(int(matrix.user_ids[row]), score) for score, row in matrix.top_k(matrix.score(prefs), limit, after=after)]
+    users = User.objects.select_related('preferences').in_bulk([user_id for user_id, _ in top])
+    return [(users[user_id], score) for user_id, score in top]
+
+
+def stored_recommendations(user, prefs, limit, after=None):
+    """
+    One page of the stored ranking as (User, score) pairs, `after` being the
+    (score, user_id) of the previous page's last row. Past the stored top
+    candidates, the rest of the ranking is scored live.
+    """
+    marker = ensure_recommendations(user, prefs)
+    stored = Recommendation.objects.filter(user=user)
+    if after:
+        score, user_id = after
+        stored = stored.filter(Q(compatibility_score__lt=score) | Q(compatibility_score=score, candidate_id__gt=user_id))
+    cutoff = None if marker.cutoff_score is None else (marker.cutoff_score, marker.cutoff_candidate)
+    if cutoff:
+        score, user_id = cutoff
+        stored = stored.filter(Q(compatibility_score__gt=score) | Q(compatibility_score=score, candidate_id__lte=user_id))
+    stored = stored.select_related('candidate__preferences').order_by('-compatibility_score', 'candidate_id')
+    page = [(row.candidate, row.compatibility_score) for row in stored[:limit]]
+
+    if cutoff and len(page) < limit:
+        # Paged past the stored top candidates: rank the rest live, after the cutoff
+        start = max(filter(None, [after, cutoff]), key=lambda c: _rank(*c))
+        page += live_recommendations(user, prefs, limit - len(page), after=start)
+    return page
+
+
+def refresh_recommendations(prefs):
+    """
+    Incremental update after one UserPreferences row changed: only the stored
+    rows involving that user are recomputed, in their own set and in the sets
+    of everyone who could be recommended them.
+    """
+    user = prefs.user
+
+    # Everyone of the same gender not matched with `user`, scored once.
+    # Scores are symmetric, so one pass covers both directions.
+    others = UserPreferences.objects.filter(
+        user__gender=user.gender
+    ).exclude(user=user).filter(~matched_with(user))
+    # A version marks a stored set, including one still being built (see build_recommendations)
+    loaded = load_preference_rows(
+        others, 'user__recommendation_set__version', 'user__recommendation_set__cutoff_score',
+        'user__recommendation_set__cutoff_candidate', 'user__is_staff', 'user__is_superuser',
+    )
+    ensure_features(prefs)
+    matrix = PreferenceMatrix(row for row, _ in loaded)
+    scores = matrix.score(prefs)
+
+    hidden = user.is_staff or user.is_superuser
+
+    with transaction.atomic():
+        # Same per-user lock as build_recommendations
+        own_set = RecommendationSet.objects.select_for_update().filter(
+            user=user
+        ).values_list('version', flat=True).first() == SCORING_VERSION
+        Recommendation.objects.filter(Q(user=user) | Q(candidate=user)).delete()
+
+        rows = []
+        staff = np.zeros(len(loaded), dtype=bool)
+        for i, ((other, (version, cutoff_score, cutoff_candidate, is_staff, is_superuser)), score) in enumerate(
+            zip(loaded, scores.tolist())
+        ):
+            staff[i] = is_staff or is_superuser
+            # `user` as a candidate in other people's sets, if it ranks within what they store
+            if version is None or hidden:
+                continue
+            if cutoff_score is None or _rank(score, user.user_id) <= _rank(cutoff_score, cutoff_candidate):
+                rows += _rows(other.user_id, [(user.user_id, score)])
+
+        if own_set:
+            # Other people as candidates in `user`'s own set: its top candidates again
+            top, cutoff = top_candidates(matrix, np.where(staff, -1, scores))
+            rows += _rows(user.user_id, top)
+        _upsert(rows)
+
+        if own_set:
+            cutoff_score, cutoff_candidate = cutoff or (None, None)
+            RecommendationSet.objects.filter(user=user).update(
+                refreshed_at=timezone.now(), cutoff_score=cutoff_score, cutoff_candidate=cutoff_candidate
+            )
+
+
+def queue_refresh(user_id):
+    """
+    Asks the refresh_recommendations worker to rescore `user_id`. Call it inside
+    the transaction of the triggering write: it is only queued if that commits.
+    """
+    RecommendationRefresh.objects.bulk_create(
+        [RecommendationRefresh(user_id=user_id, requested_at=timezone.now())],
+        update_conflicts=True, unique_fields=['user'], update_fields=['requested_at'],
+    )
+
+
+def refresh_queued_recommendations(batch_size=REFRESH_BATCH_SIZE):
+    """
+    Runs refresh_recommendations for up to `batch_size` queued users. They are
+    claimed under a lease in one short transaction, with SKIP LOCKED so several
+    workers can share the queue, and refreshed outside it. A user saved again
+    meanwhile stays queued for another pass. Returns the number of users handled.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        batch = list(RecommendationRefresh.objects.select_for_update(skip_locked=True).filter(
+            Q(lease_until__isnull=True) | Q(lease_until__lt=now)
+        ).order_by('requested_at')[:batch_size])
+        RecommendationRefresh.objects.filter(pk__in=[entry.pk for entry in batch]).update(lease_until=now + REFRESH_LEASE)
+
+    for entry in batch:
+        try:
+            prefs = UserPreferences.objects.select_related('user').filter(user_id=entry.user_id).first()
+            if prefs:
+                refresh_recommendations(prefs)
+        except Exception:
+            # Retried once the lease runs out; the rest of the batch goes on
+            logger.exception("Could not refresh recommendations of user %s", entry.user_id)
+            continue
+        entries = RecommendationRefresh.objects.filter(pk=entry.pk)
+        if not entries.filter(requested_at=entry.requested_at).delete()[0]:
+            entries.update(lease_until=None)
+    return len(batch)
+
+
+def drop_pair(user_id, other_id):
+    Recommendation.objects.filter(
+        Q(user_id=user_id, candidate_id=other_id) |
+        Q(user_id=other_id, candidate_id=user_id)
+    ).delete()
+
+
+def drop_user(user_id):
+    Recommendation.objects.filter(Q(user_id=user_id) | Q(candidate_id=user_id)).delete()
+    RecommendationSet.objects.filter(user_id=user_id).delete()
+
+
+# --- SCORING SERVICE ---
+# Short-lived memo of pair scores, shared by recommendations, match creation and batch jobs
+def _score_key(user_id, other_id):
+    # Scores are symmetric, so both directions share one entry
+    low, high = sorted((user_id, other_id))
+    return f"match-score:{SCORING_VERSION}:{low}:{high}"
+
+
+def remember_scores(user_id, scored):
+    """
+    Memoizes already computed (candidate_id, score) pairs for `user_id`.
+    """
+    cache.set_many(
+        {_score_key(user_id, candidate_id): score for candidate_id, score in scored},
+        timeout=settings.MATCH_SCORE_TTL,
+    )
+
+
+def match_score(user, candidate_id):
+    """
+    Final 0-100 score between `user` and another user: memo first, then the
+    stored recommendation row, then a fresh computation from both compact rows.
+    Returns None if either side has no preferences.
+    """
+    key = _score_key(user.user_id, candidate_id)
+    score = cache.get(key)
+    if score is not None:
+        return score
+
+    score = Recommendation.objects.filter(
+        Q(user=user, candidate_id=candidate_id) | Q(user_id=candidate_id, candidate=user)
+    ).values_list('compatibility_score', flat=True).first()
+
+    if score is None:
+        rows = {row.user_id: row for row in load_preference_rows(
+            UserPreferences.objects.filter(user_id__in=[user.user_id, candidate_id])
+        )}
+        if len(rows) < 2:
+            return None
+        score = PreferenceMatrix([rows[candidate_id]]).score(rows[user.user_id]).tolist()[0]
+
+    cache.set(key, score, timeout=settings.MATCH_SCORE_TTL)
+    return score
@@ -1,8 +1,12 @@
 # core/serializers.py
+import os
+
+from django.conf import settings
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import (
     User, UserPreferences, RoomListing, Match, Conversation, 
-    Message, Payment, Review, ListingImage, UserVerification
+    Message, Payment, Review, ListingImage, UserVerification, InboxEntry, UploadSession, ImageStatus
 )
 
 # --- 1. User & Auth Serializer ---
@@ -24,11 +28,17 @@ class UserSerializer(serializers.ModelSerializer):
         except UserPreferences.DoesNotExist:
             return None
 
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        # Preload what get_preferences reads, so lists cost a fixed number of queries
+        return queryset.select_related(f'{prefix}preferences')
+
 # --- 2. Preferences Serializer (FIXED) ---
 class UserPreferencesSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserPreferences
-        fields = '__all__'
+        # Derived from the other fields on save
+        exclude = ['interest_tags', 'feature_vector', 'interest_ids']
         # 👇 IMPORTANT: This tells Django "Don't ask frontend for user ID"
         read_only_fields = ['user'] 
     
@@ -43,15 +53,52 @@ class UserPreferencesSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 # --- 3. Image Serializer ---
+class VariantsField(serializers.ReadOnlyField):
+    """
+    Variant paths as absolute URLs: {"thumb": {"width", "height", "webp", "jpeg"}, ...}.
+    Empty until the process_images worker has run.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        storage = self.parent.Meta.model._meta.get_field(self.image_field).storage
+        result = {}
+        for name, variant in variants.items():
+            result[name] = dict(variant)
+            for fmt in ('webp', 'jpeg'):
+                url = storage.url(variant[fmt])
+                result[name][fmt] = request.build_absolute_uri(url) if request else url
+        return result
+
+class ProcessedImageField(serializers.ImageField):
+    """
+    The uploaded original, null until the process_images worker has replaced
+    it with a copy stripped of EXIF (GPS position included).
+    """
+
+    def get_attribute(self, instance):
+        if instance.processing_status != ImageStatus.READY:
+            return None
+        return super().get_attribute(instance)
+
 class ListingImageSerializer(serializers.ModelSerializer):
+    image_file = ProcessedImageField(read_only=True)
+    variants = VariantsField(image_field='image_file')
+
     class Meta:
         model = ListingImage
-        fields = ['image_id', 'image_file', 'uploaded_at']
+        fields = ['image_id', 'image_file', 'variants', 'processing_status', 'uploaded_at']
 
 # --- 4. Room Listing Serializer ---
 class RoomListingSerializer(serializers.ModelSerializer):
     images = ListingImageSerializer(many=True, read_only=True)
     owner_name = serializers.CharField(source='owner.full_name', read_only=True)
+    # Only set on "near me" searches
+    distance_km = serializers.SerializerMethodField()
     
     # Handle image uploads
     uploaded_images = serializers.ListField(
@@ -64,12 +111,20 @@ class RoomListingSerializer(serializers.ModelSerializer):
         model = RoomListing
         fields = [
             'listing_id', 'owner', 'owner_name', 
-            'title', 'description', 'city', 'area', 
+            'title', 'description', 'city', 'area', 'latitude', 'longitude', 'distance_km',
             'rent_amount', 'deposit_amount', 'room_type', 
             'available_from', 'images', 'uploaded_images', 'created_at'
         ]
         read_only_fields = ['owner', 'created_at']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('owner').prefetch_related('images')
+
+    def get_distance_km(self, obj):
+        distance = getattr(obj, 'distance_km', None)
+        return round(distance, 2) if distance is not None else None
+
     def create(self, validated_data):
         images_data = validated_data.pop('uploaded_images', [])
         listing = RoomListing.objects.create(**validated_data)
@@ -88,6 +143,11 @@ class MatchSerializer(serializers.ModelSerializer):
         fields = ['match_id', 'user', 'matched_user', 'compatibility_score', 'match_status']
         read_only_fields = ['compatibility_score', 'match_status', 'user', 'matched_user']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = UserSerializer.setup_eager_loading(queryset, prefix='user__')
+        return UserSerializer.setup_eager_loading(queryset, prefix='matched_user__')
+
 # --- 6. Messaging Serializers ---
 class MessageSerializer(serializers.ModelSerializer):
     sender_name = serializers.CharField(source='sender.full_name', read_only=True)
@@ -115,11 +175,18 @@ class ConversationSerializer(serializers.ModelSerializer):
     def get_other_participant(self, obj):
         request = self.context.get('request')
         if request and request.user:
-            other = obj.participants.exclude(pk=request.user.pk).first()
+            # Filter in Python so prefetched participants are reused
+            other = next((user for user in obj.participants.all() if user.pk != request.user.pk), None)
             if other:
                 return UserSerializer(other).data
         return None
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(
+            Prefetch('participants', queryset=UserSerializer.setup_eager_loading(User.objects.all()))
+        )
+
     def get_last_message(self, obj):
         last_msg = obj.messages.last()
         if last_msg:
@@ -130,6 +197,31 @@ class ConversationSerializer(serializers.ModelSerializer):
             }
         return None
 
+class InboxEntrySerializer(serializers.ModelSerializer):
+    # Same shape as ConversationSerializer, read from the denormalized inbox row
+    conversation_id = serializers.IntegerField(read_only=True)
+    other_participant = UserSerializer(read_only=True)
+    last_message = serializers.SerializerMethodField()
+    updated_at = serializers.DateTimeField(source='last_activity_at', read_only=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = ['conversation_id', 'other_participant', 'last_message', 'updated_at', 'unread_count']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = UserSerializer.setup_eager_loading(queryset, prefix='other_participant__')
+        return queryset.select_related('last_message')
+
+    def get_last_message(self, obj):
+        if obj.last_message_at is None:
+            return None
+        return {
+            'text': obj.last_message_text,
+            'sent_at': obj.last_message_at,
+            'is_read': bool(obj.last_message and obj.last_message.is_read)
+        }
+
 # --- 7. Payment & Review ---
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -144,15 +236,48 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 # --- 8. Verification Serializer ---
 class UserVerificationSerializer(serializers.ModelSerializer):
+    document_image = ProcessedImageField(max_length=100)
+    variants = VariantsField(image_field='document_image')
+
     class Meta:
         model = UserVerification
-        fields = ['verification_id', 'user', 'document_image', 'document_type', 'verification_status', 'submitted_at', 'rejection_reason']
+        fields = ['verification_id', 'user', 'document_image', 'variants', 'processing_status', 'document_type', 'verification_status', 'submitted_at', 'rejection_reason']
         read_only_fields = ['user', 'verification_status', 'verified_at', 'rejection_reason', 'submitted_at']
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+# --- Chunked upload sessions ---
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['upload_id', 'kind', 'listing', 'document_type', 'filename', 'size', 'received', 'status', 'created_at']
+        read_only_fields = ['upload_id', 'received', 'status', 'created_at']
+
+    def validate_filename(self, value):
+        return os.path.basename(value.replace('\\', '/')) or 'upload'
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Must be 1 to {settings.UPLOAD_MAX_SIZE} bytes.')
+        return value
+
+    def validate(self, attrs):
+        listing = attrs.get('listing')
+        if attrs['kind'] == UploadSession.LISTING_IMAGE:
+            if listing is None:
+                raise serializers.ValidationError({'listing': 'Required for listing images.'})
+            if listing.owner_id != self.context['request'].user.pk:
+                raise serializers.ValidationError({'listing': 'You can only add photos to your own listings.'})
+        elif listing is not None:
+            raise serializers.ValidationError({'listing': 'Only used for listing images.'})
+        return attrs
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
 class MeSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
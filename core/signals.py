@@ -0,0 +1,75 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .geo import encode_geohash
+from .interests import sync_interest_tags
+from .matching import store_features
+from .models import Match, RoomListing, User, UserPreferences
+from .recommendations import drop_pair, drop_user, queue_refresh
+
+
+@receiver(post_save, sender=UserPreferences)
+def preferences_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Tags and compact features first: the scorers read those
+    store_features(instance, sync_interest_tags(instance))
+    # Rescoring against everyone is left to the worker, off the request
+    queue_refresh(instance.user_id)
+
+
+@receiver(post_delete, sender=UserPreferences)
+def preferences_deleted(sender, instance, **kwargs):
+    drop_user(instance.user_id)
+
+
+# User fields that decide who can be recommended to whom
+RECOMMENDATION_FIELDS = ('gender', 'is_staff', 'is_superuser')
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._recommendation_fields = None
+    if raw or instance._state.adding:
+        return
+    # e.g. last_login updates on sign in: nothing to compare
+    if update_fields is not None and not set(update_fields) & set(RECOMMENDATION_FIELDS):
+        return
+    instance._recommendation_fields = User.objects.filter(pk=instance.pk).values_list(*RECOMMENDATION_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    before = getattr(instance, '_recommendation_fields', None)
+    if created or raw or before is None:
+        return
+    if before == tuple(getattr(instance, field) for field in RECOMMENDATION_FIELDS):
+        return
+
+    # Candidates may now be a different set entirely: drop the user's own set
+    # (rebuilt on next read) and rescore them into everyone else's
+    drop_user(instance.user_id)
+    queue_refresh(instance.user_id)
+
+
+@receiver(post_save, sender=Match)
+def match_created(sender, instance, created, raw=False, **kwargs):
+    # Matched users are never recommended to each other
+    if created and not raw:
+        drop_pair(instance.user_id, instance.matched_user_id)
+
+
+@receiver(post_delete, sender=Match)
+def match_deleted(sender, instance, origin=None, **kwargs):
+    # Skip cascades (e.g. a user being deleted), only direct unmatching counts
+    if origin is not None and getattr(origin, 'model', type(origin)) is not Match:
+        return
+
+    # The pair becomes eligible again: rescore the rows of one side
+    queue_refresh(instance.user_id)
+
+
+@receiver(pre_save, sender=RoomListing)
+def listing_location_changed(sender, instance, **kwargs):
+    has_location = instance.latitude is not None and instance.longitude is not None
+    instance.geohash = encode_geohash(instance.latitude, instance.longitude) if has_location else None
@@ -1,3 +1,1412 @@
-from django.test import TestCase
+import importlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+
+from django.apps import apps as django_apps
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from roommate_project.asgi import application
+
+from .interests import parse_interests
+from .matching import (
+    annotate_match_score, calculate_match_score, candidate_preferences, encode_features,
+    load_preference_rows, top_matches_in_database, PreferenceMatrix, PreferenceRow, MIN_RECOMMENDATION_SCORE
+)
+from PIL import Image
+
+from .geo import covering_cells, encode_geohash, haversine_km
+from .images import process_pending_images, strip_metadata
+from .inbox import changes_since, direct_conversation, record_message
+from .notifications import deliver_due_notifications, push_session, queue_push_notification
+from .uploads import expire_stale_uploads, receive_chunk, upload_path
+from .models import (
+    User, UserPreferences, Match, Conversation, Message, PushNotification, RoomListing, ListingImage,
+    UploadSession, UserVerification, Recommendation, RecommendationSet, RecommendationRefresh, InterestTag
+)
+from .management.commands.precompute_recommendations import Command as PrecomputeCommand
+from .benchmarks import generate_population, reset_recommendations
+from .recommendations import build_recommendations, ensure_recommendations, refresh_queued_recommendations
+
+
+def make_user(n, gender='male', **prefs):
+    user = User.objects.create_user(
+        email=f'user{n}@example.com', phone_number=f'0700{n:06d}',
+        full_name=f'User {n}', gender=gender
+    )
+    if prefs:
+        UserPreferences.objects.create(user=user, **prefs)
+    return user
+
+
+class CompatibilityParityTests(TestCase):
+    """
+    The SQL and vectorized scorers must agree with calculate_match_score on every pair.
+    """
+
+    CLEANLINESS = ['low', 'Medium', 'HIGH', 'spotless', None]
+    SLEEP = ['early', 'late', 'Early', '', None]
+    CITIES = ['Nairobi', 'nairobi', 'NAIROBI', 'Mombasa', '', None]
+    INTERESTS = [None, '', 'football, Music', 'music', ' Football ,chess', 'chess,,', ',', 'hiking']
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(42)
+        for n in range(80):
+            make_user(
+                n,
+                cleanliness_level=rnd.choice(cls.CLEANLINESS),
+                smoking=rnd.random() < 0.5,
+                pets=rnd.random() < 0.5,
+                guests_allowed=rnd.random() < 0.5,
+                sleep_schedule=rnd.choice(cls.SLEEP),
+                city=rnd.choice(cls.CITIES),
+                other_interests=rnd.choice(cls.INTERESTS),
+            )
+
+    def test_database_scores_match_python(self):
+        everyone = list(UserPreferences.objects.all())
+        for prefs in everyone:
+            expected = {c.user_id: calculate_match_score(prefs, c) for c in everyone}
+            actual = dict(
+                annotate_match_score(UserPreferences.objects.all(), prefs).values_list('user_id', 'match_score')
+            )
+            self.assertEqual(actual, expected, f'mismatch for user {prefs.user_id}')
+
+    def test_vectorized_scores_match_python(self):
+        everyone = list(UserPreferences.objects.all())
+        matrix = PreferenceMatrix(everyone)
+        for prefs in everyone:
+            expected = [calculate_match_score(prefs, c) for c in everyone]
+            self.assertEqual(matrix.score(prefs).tolist(), expected)
+
+    def test_score_is_clamped_between_0_and_100(self):
+        base = dict(cleanliness_level='low', smoking=True, pets=True, guests_allowed=True,
+                    sleep_schedule='early', city='Nairobi', other_interests='football')
+        perfect = make_user(1000, **base).preferences
+        twin = make_user(1001, **base).preferences
+        opposite = make_user(1002, cleanliness_level='high', smoking=False, pets=False, guests_allowed=False,
+                             sleep_schedule='late', city='Kisumu', other_interests='chess').preferences
+
+        for other, expected in [(twin, 100), (opposite, 0)]:
+            self.assertEqual(calculate_match_score(perfect, other), expected)
+            scored = annotate_match_score(UserPreferences.objects.filter(pk=other.pk), perfect).get()
+            self.assertEqual(scored.match_score, expected)
+
+    def test_top_matches_in_database_ranks_like_python(self):
+        user = User.objects.order_by('user_id').first()
+        prefs = user.preferences
+        candidates = UserPreferences.objects.exclude(user=user)
+        expected = sorted(
+            ((calculate_match_score(prefs, c), c.user_id) for c in candidates),
+            key=lambda x: (-x[0], x[1])
+        )
+        expected = [(uid, s) for s, uid in expected if s >= MIN_RECOMMENDATION_SCORE][:10]
+
+        top = top_matches_in_database(user, prefs, 10)
+        self.assertEqual([(p.user_id, p.match_score) for p in top], expected)
+
+
+class PreferenceMatrixTests(SimpleTestCase):
+    """
+    PreferenceMatrix scores exactly like calculate_match_score, straight from
+    the compact rows (no database involved).
+    """
+
+    def test_every_feature_combination_matches_python(self):
+        values = itertools.product(
+            ['low', 'Medium', 'HIGH', None], [True, False], [True, False], [True, False],
+            ['early', 'late', None], ['Nairobi', 'mombasa', 'NAIROBI', None],
+            [None, 'music', 'Music, football', ' chess ,', ''],
+        )
+        tag_ids = {}
+        everyone, rows = [], []
+        for n, (clean, smoking, pets, guests, sleep, city, interests) in enumerate(values):
+            prefs = UserPreferences(
+                user_id=n, cleanliness_level=clean, smoking=smoking, pets=pets, guests_allowed=guests,
+                sleep_schedule=sleep, city=city, other_interests=interests,
+            )
+            ids = [tag_ids.setdefault(tag, len(tag_ids) + 1) for tag in parse_interests(interests)]
+            everyone.append(prefs)
+            rows.append(PreferenceRow(n, encode_features(prefs), sorted(ids), sleep, city))
+
+        # Tag ids far apart cost nothing extra: memory follows the links, not the vocabulary
+        rows = [row._replace(interest_ids=[tag_id * 10 ** 8 for tag_id in row.interest_ids]) for row in rows]
+        matrix = PreferenceMatrix(rows)
+        self.assertLess(matrix.interest_tags.nbytes + matrix.interest_rows.nbytes, 10 ** 5)
+        for prefs, row in random.Random(1).sample(list(zip(everyone, rows)), 40):
+            expected = [calculate_match_score(prefs, other) for other in everyone]
+            self.assertEqual(matrix.score(row).tolist(), expected)
+
+
+class CandidateFilterTests(TestCase):
+
+    def test_excludes_self_staff_other_genders_and_matches(self):
+        prefs = dict(city='Nairobi')
+        user = make_user(0, **prefs)
+        eligible = make_user(1, **prefs)
+        make_user(2, gender='female', **prefs)
+        staff = make_user(3, **prefs)
+        admin = make_user(4, **prefs)
+        User.objects.filter(pk=staff.pk).update(is_staff=True)
+        User.objects.filter(pk=admin.pk).update(is_superuser=True)
+        # Matches count in either direction, whatever their status
+        sent, received = make_user(5, **prefs), make_user(6, **prefs)
+        Match.objects.create(user=user, matched_user=sent, compatibility_score=50)
+        Match.objects.create(user=received, matched_user=user, compatibility_score=50, match_status='rejected')
+        # Matches between other people do not hide them
+        Match.objects.create(user=eligible, matched_user=sent, compatibility_score=50)
+
+        with CaptureQueriesContext(connection) as captured:
+            ids = [p.user_id for p in candidate_preferences(user)]
+        self.assertEqual(ids, [eligible.user_id])
+        self.assertEqual(len(captured), 1)
+
+
+class RecommendationEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(7)
+        combos = itertools.product(['low', 'medium', 'high'], [True, False], ['early', 'late'])
+        for n, (clean, smoking, sleep) in enumerate(combos):
+            make_user(
+                n, gender='female' if n % 5 == 0 else 'male',
+                cleanliness_level=clean, smoking=smoking, sleep_schedule=sleep,
+                pets=rnd.random() < 0.5, city=rnd.choice(['Nairobi', 'Mombasa']),
+                other_interests=rnd.choice(['football', 'music, football', None]),
+            )
+        cls.user = User.objects.filter(gender='male').order_by('user_id').first()
+        matched = User.objects.filter(gender='male').order_by('user_id')[1]
+        Match.objects.create(user=matched, matched_user=cls.user, compatibility_score=50)
+        cls.matched = matched
+        refresh_queued_recommendations(batch_size=100)
+
+    def fetch(self, limit=100):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        ranking, cursor = [], None
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            response = client.get('/api/matches/recommendations/', params)
+            self.assertEqual(response.status_code, 200)
+            ranking += [(row['user']['user_id'], row['compatibility_score']) for row in response.data['results']]
+            cursor = response.data['next']
+            if not cursor:
+                return ranking
+
+    def test_engines_return_the_same_ranking(self):
+        with override_settings(RECOMMENDATION_ENGINE='python'):
+            python_ranking = self.fetch()
+        self.assertTrue(python_ranking)
+        for engine in ['database', 'materialized']:
+            with override_settings(RECOMMENDATION_ENGINE=engine):
+                self.assertEqual(self.fetch(), python_ranking)
+
+    def test_cursor_pages_follow_the_full_ranking(self):
+        for engine in ['python', 'database', 'materialized']:
+            with override_settings(RECOMMENDATION_ENGINE=engine):
+                self.assertEqual(self.fetch(limit=3), self.fetch())
+
+    @override_settings(RECOMMENDATION_ENGINE='materialized')
+    def test_stored_set_follows_preference_changes_and_matches(self):
+        self.fetch()
+        other = User.objects.filter(gender='male').exclude(pk__in=[self.user.pk, self.matched.pk]).last()
+
+        prefs = other.preferences
+        for field in ['cleanliness_level', 'smoking', 'sleep_schedule', 'pets', 'guests_allowed', 'city', 'other_interests']:
+            setattr(prefs, field, getattr(self.user.preferences, field))
+        with self.assertNumQueries(5):
+            # Only queued: the rescoring runs in the worker
+            prefs.save()
+        self.assertTrue(RecommendationRefresh.objects.filter(user=other).exists())
+        self.assertEqual(refresh_queued_recommendations(), 1)
+        self.assertFalse(RecommendationRefresh.objects.exists())
+        stored = self.fetch()
+        self.assertIn((other.user_id, calculate_match_score(self.user.preferences, prefs)), stored)
+        with override_settings(RECOMMENDATION_ENGINE='python'):
+            self.assertEqual(stored, self.fetch())
+
+        Match.objects.create(user=self.user, matched_user=other, compatibility_score=95)
+        self.assertNotIn(other.user_id, {uid for uid, _ in self.fetch()})
+
+    @override_settings(RECOMMENDATION_ENGINE='materialized', RECOMMENDATION_STORE_LIMIT=3)
+    def test_only_the_top_candidates_are_stored(self):
+        with override_settings(RECOMMENDATION_ENGINE='python'):
+            expected = self.fetch()
+        self.assertGreater(len(expected), 3)
+        # Pages past the stored ones are ranked live
+        self.assertEqual(self.fetch(limit=2), expected)
+        self.assertEqual(self.fetch(), expected)
+        self.assertEqual(Recommendation.objects.filter(user=self.user).count(), 3)
+
+        # A candidate moving into or out of the top keeps the ranking exact
+        for other in [User.objects.get(user_id=expected[-1][0]), User.objects.get(user_id=expected[0][0])]:
+            prefs = other.preferences
+            prefs.smoking, prefs.city = self.user.preferences.smoking, self.user.preferences.city
+            if other.user_id == expected[0][0]:
+                prefs.smoking = not prefs.smoking
+            prefs.save()
+            refresh_queued_recommendations()
+            with override_settings(RECOMMENDATION_ENGINE='python'):
+                expected = self.fetch()
+            self.assertEqual(self.fetch(limit=2), expected)
+
+    @override_settings(RECOMMENDATION_ENGINE='materialized')
+    def test_stored_set_follows_gender_and_staff_changes(self):
+        self.fetch()
+        staff = User.objects.get(user_id=self.fetch()[0][0])
+        staff.is_staff = True
+        staff.save()
+        refresh_queued_recommendations()
+        self.assertNotIn(staff.user_id, {uid for uid, _ in self.fetch()})
+
+        self.user.gender = 'female'
+        self.user.save()
+        refresh_queued_recommendations()
+        stored = self.fetch()
+        ids = {uid for uid, _ in stored}
+        self.assertTrue(ids)
+        self.assertFalse(User.objects.filter(user_id__in=ids).exclude(gender='female').exists())
+        with override_settings(RECOMMENDATION_ENGINE='python'):
+            self.assertEqual(stored, self.fetch())
+
+    def test_connecting_keeps_the_recommended_score(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        top = client.get('/api/matches/recommendations/').data['results'][0]
+
+        response = client.post('/api/matches/', {'matched_user': top['user']['user_id']})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(float(response.data['compatibility_score']), top['compatibility_score'])
+
+    def test_excludes_other_genders_and_existing_matches(self):
+        ids = {uid for uid, _ in self.fetch()}
+        self.assertNotIn(self.matched.user_id, ids)
+        self.assertFalse(User.objects.filter(user_id__in=ids).exclude(gender='male').exists())
+
+
+class InterestTagTests(TestCase):
+
+    def test_tags_are_normalized_and_follow_edits(self):
+        prefs = make_user(0, other_interests=' Football ,music,,MUSIC, ').preferences
+        self.assertEqual(set(prefs.interest_tags.values_list('name', flat=True)), {'football', 'music'})
+
+        prefs.other_interests = 'Chess, football'
+        prefs.save()
+        self.assertEqual(set(prefs.interest_tags.values_list('name', flat=True)), {'chess', 'football'})
+        make_user(1, other_interests='FOOTBALL')
+        self.assertEqual(InterestTag.objects.filter(name='football').count(), 1)
+
+    def test_backfill_migration(self):
+        make_user(0, other_interests='Football, music')
+        make_user(1, other_interests='music,, ')
+        make_user(2, other_interests=None)
+        expected = sorted(UserPreferences.interest_tags.through.objects.values_list(
+            'userpreferences__user_id', 'interesttag__name'
+        ))
+        UserPreferences.interest_tags.through.objects.all().delete()
+        InterestTag.objects.all().delete()
+
+        migration = importlib.import_module('core.migrations.0013_backfill_interest_tags')
+        migration.backfill_interest_tags(django_apps, None)
+        self.assertEqual(sorted(UserPreferences.interest_tags.through.objects.values_list(
+            'userpreferences__user_id', 'interesttag__name'
+        )), expected)
+        self.assertEqual(len(expected), 3)
+
+    def test_directory_filters_on_interests(self):
+        client = APIClient()
+        client.force_authenticate(make_user(0, other_interests='football, music'))
+        both = make_user(1, other_interests='Music, FOOTBALL')
+        football = make_user(2, other_interests='football')
+        chess = make_user(3, other_interests='chess')
+
+        def ids(params):
+            response = client.get('/api/roommates/', params)
+            self.assertEqual(response.status_code, 200)
+            return sorted(row['user_id'] for row in response.data)
+
+        self.assertEqual(ids({'interest': 'Football'}), [both.user_id, football.user_id])
+        self.assertEqual(ids({'interest': ['football', ' MUSIC']}), [both.user_id])
+        self.assertEqual(ids({'interest': 'football,music'}), [both.user_id])
+        self.assertEqual(ids({'search': 'chess'}), [chess.user_id])
+
+
+class BenchmarkPopulationTests(TestCase):
+
+    def snapshot(self):
+        users = User.objects.filter(email__startswith='bench').order_by('email')
+        prefs = UserPreferences.objects.filter(user__in=users).order_by('user__email')
+        matches = Match.objects.order_by('user__email', 'matched_user__email')
+        return (
+            list(users.values_list('email', 'gender')),
+            list(prefs.values_list(
+                'user__email', 'cleanliness_level', 'smoking', 'pets', 'guests_allowed', 'sleep_schedule',
+                'city', 'other_interests', 'is_actively_looking', 'feature_vector', 'interest_ids',
+            )),
+            list(matches.values_list('user__email', 'matched_user__email')),
+        )
+
+    def test_population_is_deterministic(self):
+        generate_population(60, seed=4, match_rate=0.3, batch_size=25)
+        first = self.snapshot()
+        self.assertTrue(first[2])
+
+        User.objects.all().delete()
+        # Grown in two steps or in one, user n is the same
+        generate_population(20, seed=4, match_rate=0.3, batch_size=25)
+        generate_population(60, seed=4, match_rate=0.3, batch_size=25)
+        self.assertEqual(self.snapshot(), first)
+
+        User.objects.all().delete()
+        generate_population(60, seed=5, match_rate=0.3, batch_size=25)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_reset_drops_stored_sets(self):
+        generate_population(30, seed=1)
+        user = User.objects.get(email='bench0@example.com')
+        ensure_recommendations(user, user.preferences)
+        self.assertTrue(RecommendationSet.objects.exists())
+        reset_recommendations()
+        self.assertFalse(RecommendationSet.objects.exists() or Recommendation.objects.exists())
+
+
+class ListQueryCountTests(TestCase):
+    """
+    Listing N users or matches costs the same number of queries whatever N is.
+    """
+
+    def setUp(self):
+        self.user = make_user(0, city='Nairobi', is_actively_looking=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.count = 0
+
+    def grow(self, n):
+        for _ in range(n):
+            self.count += 1
+            other = make_user(self.count, city='Nairobi', is_actively_looking=True)
+            Match.objects.create(user=self.user, matched_user=other, compatibility_score=50)
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def assert_constant(self, url):
+        self.grow(2)
+        small = self.queries_for(url)
+        self.grow(4)
+        self.assertEqual(self.queries_for(url), small)
+
+    def test_users(self):
+        self.assert_constant('/api/users/')
+
+    def test_matches(self):
+        self.assert_constant('/api/matches/')
+
+    def test_roommates(self):
+        self.assert_constant('/api/roommates/')
+
+
+class InboxTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user(0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, other):
+        return self.client.post('/api/conversations/start/', {'user_id': other.user_id}).data['conversation_id']
+
+    def send(self, sender, conversation_id, text):
+        client = APIClient()
+        client.force_authenticate(sender)
+        response = client.post('/api/messages/', {'conversation': conversation_id, 'message_text': text})
+        self.assertEqual(response.status_code, 201)
+
+    def inbox(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(captured)
+
+    def test_inbox_follows_new_messages(self):
+        alice, bob = make_user(1), make_user(2)
+        with_alice, with_bob = self.start(alice), self.start(bob)
+        self.send(alice, with_alice, 'hi')
+        self.send(alice, with_alice, 'are you there?')
+        self.send(self.user, with_bob, 'hello bob')
+
+        inbox, _ = self.inbox()
+        self.assertEqual([row['conversation_id'] for row in inbox], [with_bob, with_alice])
+        self.assertEqual(inbox[0]['other_participant']['user_id'], bob.user_id)
+        self.assertEqual(inbox[0]['last_message']['text'], 'hello bob')
+        self.assertEqual(inbox[0]['unread_count'], 0)
+        self.assertEqual(inbox[1]['last_message']['text'], 'are you there?')
+        self.assertEqual(inbox[1]['unread_count'], 2)
+
+    def test_deleting_an_account_keeps_the_other_side_history(self):
+        alice = make_user(1)
+        conversation_id = self.start(alice)
+        self.send(self.user, conversation_id, 'still mine')
+        self.send(alice, conversation_id, 'bye')
+        alice.delete()
+
+        inbox, _ = self.inbox()
+        self.assertEqual([row['conversation_id'] for row in inbox], [conversation_id])
+        self.assertIsNone(inbox[0]['other_participant'])
+        texts = Message.objects.filter(conversation_id=conversation_id).values_list('message_text', flat=True)
+        self.assertEqual(list(texts), ['still mine'])
+
+    def test_start_returns_the_existing_conversation(self):
+        alice = make_user(1)
+        first = self.client.post('/api/conversations/start/', {'user_id': alice.user_id})
+        again = self.client.post('/api/conversations/start/', {'user_id': alice.user_id})
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+
+        other = APIClient()
+        other.force_authenticate(alice)
+        back = other.post('/api/conversations/start/', {'user_id': self.user.user_id})
+        self.assertEqual({again.data['conversation_id'], back.data['conversation_id']}, {first.data['conversation_id']})
+
+    def test_mark_read_up_to_a_message(self):
+        alice = make_user(1)
+        conversation_id = self.start(alice)
+        for text in ['a', 'b', 'c']:
+            self.send(alice, conversation_id, text)
+        self.send(self.user, conversation_id, 'mine')
+        second = Message.objects.get(message_text='b').message_id
+
+        response = self.client.post(f'/api/conversations/{conversation_id}/mark_read/', {'up_to': second})
+        self.assertEqual(response.data, {'marked': 2, 'unread_count': 1})
+        self.assertEqual(self.inbox()[0][0]['unread_count'], 1)
+
+        response = self.client.post(f'/api/conversations/{conversation_id}/mark_read/')
+        self.assertEqual(response.data, {'marked': 1, 'unread_count': 0})
+        # Own messages stay unread until the other side reads them
+        self.assertEqual(list(Message.objects.filter(is_read=False).values_list('message_text', flat=True)), ['mine'])
+
+        other = APIClient()
+        other.force_authenticate(make_user(9))
+        self.assertEqual(other.post(f'/api/conversations/{conversation_id}/mark_read/').status_code, 404)
+
+    def test_inbox_costs_constant_queries(self):
+        def grow(numbers):
+            for n in numbers:
+                other = make_user(n)
+                self.send(other, self.start(other), 'hi')
+
+        grow(range(1, 3))
+        inbox, small = self.inbox()
+        self.assertEqual(len(inbox), 2)
+        grow(range(3, 7))
+        inbox, large = self.inbox()
+        self.assertEqual(len(inbox), 6)
+        self.assertEqual(large, small)
+
+
+class MessageHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user, self.other = make_user(0), make_user(1)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.other, message_text=str(n)) for n in range(7)
+        ])
+        # Same timestamp everywhere: message_id alone has to break the ties
+        Message.objects.update(sent_at=Message.objects.first().sent_at)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def page(self, **params):
+        response = self.client.get('/api/messages/', {'conversation': self.conversation.pk, 'limit': 3, **params})
+        self.assertEqual(response.status_code, 200)
+        return [m['message_text'] for m in response.data['results']], response.data
+
+    def test_pages_back_through_history(self):
+        texts, data = self.page()
+        self.assertEqual(texts, ['4', '5', '6'])
+        texts, data = self.page(before=data['older'])
+        self.assertEqual(texts, ['1', '2', '3'])
+        texts, data = self.page(before=data['older'])
+        self.assertEqual(texts, ['0'])
+        self.assertIsNone(data['older'])
+
+    def test_after_returns_only_new_messages(self):
+        _, data = self.page()
+        texts, polled = self.page(after=data['newer'])
+        self.assertEqual(texts, [])
+        self.assertEqual(polled['newer'], data['newer'])
+
+        Message.objects.create(conversation=self.conversation, sender=self.other, message_text='new')
+        texts, _ = self.page(after=data['newer'])
+        self.assertEqual(texts, ['new'])
+
+
+class SyncTests(TransactionTestCase):
+    # Sync redelivers what transactions still running may commit below, so
+    # inside the test's own transaction nothing would ever settle: commit as the app does
+
+    def setUp(self):
+        self.user, self.other = make_user(0), make_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.other_client = APIClient()
+        self.other_client.force_authenticate(self.other)
+        self.conversation_id = self.client.post(
+            '/api/conversations/start/', {'user_id': self.other.user_id}
+        ).data['conversation_id']
+
+    def sync(self, since=None):
+        response = self.client.get('/api/conversations/sync/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def send(self, text):
+        self.other_client.post('/api/messages/', {'conversation': self.conversation_id, 'message_text': text})
+
+    def test_returns_only_changes_after_the_watermark(self):
+        first = self.sync()
+        self.assertEqual([c['conversation_id'] for c in first['conversations']], [self.conversation_id])
+        self.assertEqual(first['messages'], [])
+
+        idle = self.sync(first['watermark'])
+        self.assertEqual((idle['conversations'], idle['messages']), ([], []))
+
+        self.send('hello')
+        changed = self.sync(idle['watermark'])
+        self.assertEqual([m['message_text'] for m in changed['messages']], ['hello'])
+        self.assertEqual(changed['conversations'][0]['unread_count'], 1)
+
+        # A read-state change comes back as an updated message
+        Message.objects.update(is_read=True)
+        read = self.sync(changed['watermark'])
+        self.assertEqual([m['is_read'] for m in read['messages']], [True])
+
+    def test_large_backlogs_come_in_batches(self):
+        _, _, watermark, _ = changes_since(self.user)
+        for n in range(5):
+            self.send(str(n))
+
+        texts = []
+        while True:
+            _, messages, watermark, has_more = changes_since(self.user, watermark, limit=2)
+            texts += [m.message_text for m in messages]
+            if not has_more:
+                break
+        self.assertEqual(texts, ['0', '1', '2', '3', '4'])
+
+    def test_message_committing_after_a_later_watermark_is_not_skipped(self):
+        watermark = self.sync()['watermark']
+        conversation = Conversation.objects.get(pk=self.conversation_id)
+        other_conversation, _ = direct_conversation(self.user, make_user(2))
+        inserted, release = threading.Event(), threading.Event()
+
+        def send_slowly():
+            try:
+                with transaction.atomic():
+                    record_message(Message.objects.create(conversation=conversation, sender=self.other, message_text='slow'))
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=send_slowly)
+        thread.start()
+        self.assertTrue(inserted.wait(10))
+        # Sent after 'slow' but committed before it
+        record_message(Message.objects.create(conversation=other_conversation, sender=self.user, message_text='fast'))
+        during = self.sync(watermark)
+        release.set()
+        thread.join()
+        after = self.sync(during['watermark'])
+
+        self.assertEqual([m['message_text'] for m in during['messages']], ['fast'])
+        # 'fast' may come again: clients replace rows by id
+        self.assertEqual({m['message_text'] for m in after['messages']} - {'fast'}, {'slow'})
+        self.assertIn(self.conversation_id, [c['conversation_id'] for c in after['conversations']])
+
+    def test_unrelated_open_transaction_does_not_hold_back_sync(self):
+        watermark = self.sync()['watermark']
+        stranger = make_user(2)
+        started, release = threading.Event(), threading.Event()
+
+        def hold_transaction():
+            try:
+                with transaction.atomic():
+                    # e.g. a long worker batch, writing rows no sync reads
+                    User.objects.filter(pk=stranger.pk).update(full_name='Busy')
+                    started.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=hold_transaction)
+        thread.start()
+        try:
+            self.assertTrue(started.wait(10))
+            self.send('hello')
+            changed = self.sync(watermark)
+            self.assertEqual([m['message_text'] for m in changed['messages']], ['hello'])
+
+            # Redelivered while the open transaction could still commit below it,
+            # until it has run longer than sync waits on one
+            watermark = changed['watermark']
+            with mock.patch('core.inbox.SYNC_MAX_TRANSACTION_AGE', 0):
+                for _ in range(2):
+                    again = self.sync(watermark)
+                    self.assertEqual([m['message_text'] for m in again['messages']], ['hello'])
+                    watermark = again['watermark']
+                self.assertEqual(self.sync(watermark)['messages'], [])
+        finally:
+            release.set()
+            thread.join()
+
+
+class ChatSocketTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user, self.other = make_user(0), make_user(1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.conversation_id = client.post(
+            '/api/conversations/start/', {'user_id': self.other.user_id}
+        ).data['conversation_id']
+
+    def send(self, text):
+        client = APIClient()
+        client.force_authenticate(self.other)
+        return client.post('/api/messages/', {'conversation': self.conversation_id, 'message_text': text})
+
+    async def test_new_messages_are_pushed_to_participants(self):
+        socket = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(self.user)}')
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+
+        await sync_to_async(self.send)('hello')
+        event = await socket.receive_json_from()
+        self.assertEqual(event['type'], 'message')
+        self.assertEqual(event['message']['message_text'], 'hello')
+        self.assertEqual(event['message']['conversation'], self.conversation_id)
+        self.assertFalse(event['message']['is_me'])
+        await socket.disconnect()
+
+    async def test_rejects_sockets_without_a_valid_token(self):
+        for path in ['/ws/chat/', '/ws/chat/?token=nope']:
+            connected, _ = await WebsocketCommunicator(application, path).connect()
+            self.assertFalse(connected)
+
+
+class ConversationRaceTests(TransactionTestCase):
+
+    def test_concurrent_starts_share_one_conversation(self):
+        user, other = make_user(0), make_user(1)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def start(a, b):
+            try:
+                barrier.wait()
+                results.append(direct_conversation(a, b)[0].pk)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=start, args=pair) for pair in [(user, other), (other, user)] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(Conversation.objects.count(), 1)
+        self.assertEqual(Conversation.objects.get().participants.count(), 2)
+
+
+class RecommendationRaceTests(TransactionTestCase):
+
+    @override_settings(RECOMMENDATION_ENGINE='materialized')
+    def test_concurrent_first_loads_and_saves(self):
+        users = [make_user(n, city='Nairobi', smoking=n % 2 == 0) for n in range(6)]
+        barrier = threading.Barrier(6)
+        errors = []
+
+        def run(task):
+            try:
+                barrier.wait()
+                task()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        def first_load():
+            client = APIClient()
+            client.force_authenticate(users[0])
+            response = client.get('/api/matches/recommendations/')
+            if response.status_code != 200:
+                raise AssertionError(response.status_code)
+
+        def save_preferences(n):
+            def task():
+                prefs = UserPreferences.objects.select_related('user').get(user=users[n])
+                prefs.smoking = not prefs.smoking
+                prefs.save()
+                # A worker pass right away, racing the first loads
+                refresh_queued_recommendations()
+            return task
+
+        tasks = [first_load] * 3 + [save_preferences(n) for n in (1, 2, 3)]
+        threads = [threading.Thread(target=run, args=(task,)) for task in tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        refresh_queued_recommendations()
+
+        client = APIClient()
+        client.force_authenticate(users[0])
+        stored = client.get('/api/matches/recommendations/').data['results']
+        with override_settings(RECOMMENDATION_ENGINE='python'):
+            self.assertEqual(client.get('/api/matches/recommendations/').data['results'], stored)
+
+
+@override_settings(RECOMMENDATION_STORE_LIMIT=5)
+class PrecomputeRecommendationsTests(TransactionTestCase):
+
+    def setUp(self):
+        rnd = random.Random(3)
+        for n in range(24):
+            make_user(
+                n, gender='female' if n % 3 == 0 else 'male',
+                cleanliness_level=rnd.choice(['low', 'medium', 'high']), smoking=rnd.random() < 0.5,
+                sleep_schedule=rnd.choice(['early', 'late']), city=rnd.choice(['Nairobi', 'Mombasa']),
+                other_interests=rnd.choice(['football', 'music, football', None]),
+                is_actively_looking=n != 4,
+            )
+        users = list(User.objects.order_by('user_id'))
+        User.objects.filter(pk=users[5].pk).update(is_staff=True)
+        Match.objects.create(user=users[1], matched_user=users[2], compatibility_score=50)
+        Match.objects.create(user=users[7], matched_user=users[1], compatibility_score=50)
+        self.users = users
+
+    def stored(self):
+        rows = Recommendation.objects.order_by('user_id', '-compatibility_score', 'candidate_id')
+        cutoffs = RecommendationSet.objects.values_list('user_id', 'cutoff_score', 'cutoff_candidate')
+        return list(rows.values_list('user_id', 'candidate_id', 'compatibility_score')), sorted(cutoffs)
+
+    def precompute(self, **options):
+        call_command('precompute_recommendations', workers=1, shard_size=4, stdout=io.StringIO(), **options)
+
+    def test_matches_build_recommendations(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        checkpoint = os.path.join(directory.name, 'checkpoint.json')
+        # An interrupted run already finished the female shards
+        female = load_preference_rows(UserPreferences.objects.filter(user__gender='female', is_actively_looking=True))
+        with open(checkpoint, 'w') as f:
+            json.dump([key for key, _ in PrecomputeCommand().shard('female', female, {}, 4)], f)
+
+        self.precompute(checkpoint=checkpoint)
+        self.assertFalse(os.path.exists(checkpoint))
+        seekers = set(RecommendationSet.objects.values_list('user_id', flat=True))
+        expected_seekers = {
+            u.user_id for u in self.users if u.gender == 'male' and u.user_id not in (self.users[4].user_id, self.users[5].user_id)
+        }
+        self.assertEqual(seekers, expected_seekers)
+
+        # Same rows and cutoffs as building each set on its own, for both write paths
+        self.precompute()
+        copied = self.stored()
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            self.precompute()
+        self.assertEqual(self.stored(), copied)
+
+        for user_id, *_ in copied[1]:
+            user = User.objects.get(user_id=user_id)
+            build_recommendations(user, user.preferences)
+        self.assertEqual(self.stored(), copied)
+        self.assertTrue(any(cutoff for _, cutoff, _ in copied[1]))
+
+        pairs = {(user_id, candidate_id) for user_id, candidate_id, _ in copied[0]}
+        for a, b in [(1, 2), (7, 1)]:
+            a, b = self.users[a].user_id, self.users[b].user_id
+            self.assertFalse({(a, b), (b, a)} & pairs)
+
+
+class StubExpoHandler(BaseHTTPRequestHandler):
+    # Replies with the next queued (status code, body); records every payload
+    def do_POST(self):
+        self.server.received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        if getattr(self.server, 'during_request', None):
+            self.server.during_request()
+        code, body = self.server.replies.pop(0)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class NotificationOutboxTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubExpoHandler)
+        self.server.received, self.server.replies = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.user = make_user(0)
+        ids = [make_user(n).pk for n in range(1, 4)]
+        User.objects.filter(pk__in=ids).update(expo_push_token='ExponentPushToken[abc]')
+        self.recipients = list(User.objects.filter(pk__in=ids).order_by('pk'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.conversation_ids = [
+            self.client.post('/api/conversations/start/', {'user_id': r.user_id}).data['conversation_id']
+            for r in self.recipients
+        ]
+        for n, text in enumerate(['one', 'two', 'three']):
+            self.send(n, text)
+
+    def send(self, n, text):
+        self.client.post('/api/messages/', {'conversation': self.conversation_ids[n], 'message_text': text})
+
+    def deliver(self, batch_size=100):
+        with override_settings(EXPO_PUSH_URL=f'http://127.0.0.1:{self.server.server_port}/'):
+            with push_session() as session:
+                return deliver_due_notifications(session, batch_size)
+
+    def test_messages_are_queued_and_sent_in_one_batch(self):
+        self.assertEqual(PushNotification.objects.filter(status='pending').count(), 3)
+        self.server.replies.append((200, {'data': [{'status': 'ok'}] * 3}))
+
+        self.assertEqual(self.deliver(), 3)
+        self.assertEqual([m['body'] for m in self.server.received[0]], ['one', 'two', 'three'])
+        self.assertEqual(PushNotification.objects.filter(status='sent').count(), 3)
+        self.assertEqual(self.deliver(), 0)
+
+    def test_failures_are_retried_with_backoff(self):
+        self.server.replies += [
+            (503, {}),
+            (200, {'data': [
+                {'status': 'ok'},
+                {'status': 'error', 'message': 'rate limited', 'details': {'error': 'MessageRateExceeded'}},
+                {'status': 'error', 'details': {'error': 'DeviceNotRegistered'}},
+            ]}),
+        ]
+        self.assertEqual(self.deliver(), 3)
+        retried = PushNotification.objects.all()
+        self.assertEqual({(n.status, n.attempts) for n in retried}, {('pending', 1)})
+        # Not due again until the backoff has passed
+        self.assertEqual(self.deliver(), 0)
+
+        PushNotification.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.deliver(), 3)
+        statuses = list(PushNotification.objects.order_by('pk').values_list('status', flat=True))
+        self.assertEqual(statuses, ['sent', 'pending', 'failed'])
+        self.assertIsNone(User.objects.get(pk=self.recipients[2].pk).expo_push_token)
+
+    def test_bursts_in_a_conversation_are_coalesced(self):
+        self.send(0, 'again')
+        self.send(0, 'and again')
+        first = PushNotification.objects.get(conversation_id=self.conversation_ids[0])
+        self.assertEqual((first.message_count, first.title, first.body), (3, '3 new messages from User 0', 'and again'))
+
+        self.server.replies.append((200, {'data': [{'status': 'ok'}] * 3}))
+        self.assertEqual(self.deliver(), 3)
+
+        # Right after a push, the next one waits for the window so the burst can join it
+        self.send(0, 'later')
+        self.send(0, 'more')
+        self.assertEqual(self.deliver(), 0)
+        held = PushNotification.objects.get(status='pending')
+        self.assertEqual((held.message_count, held.body), (2, 'more'))
+        self.assertGreater(held.next_attempt_at, timezone.now())
+
+    @override_settings(PUSH_RATE_LIMIT=2)
+    def test_rate_cap_per_recipient(self):
+        for n in range(3):
+            queue_push_notification(self.recipients[0], 'Reminder', str(n))
+        self.server.replies.append((200, {'data': [{'status': 'ok'}] * 4}))
+
+        self.assertEqual(self.deliver(), 6)
+        self.assertEqual(len(self.server.received[0]), 4)
+        sent = PushNotification.objects.filter(status='sent')
+        self.assertEqual(sent.filter(recipient=self.recipients[0]).count(), 2)
+        self.assertEqual(PushNotification.objects.filter(status='pending', next_attempt_at__gt=timezone.now()).count(), 2)
+
+
+class NotificationLeaseTests(TransactionTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubExpoHandler)
+        self.server.received, self.server.replies = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.client = APIClient()
+        self.client.force_authenticate(make_user(0))
+        recipient = make_user(1)
+        User.objects.filter(pk=recipient.pk).update(expo_push_token='ExponentPushToken[abc]')
+        self.conversation_id = self.client.post(
+            '/api/conversations/start/', {'user_id': recipient.user_id}
+        ).data['conversation_id']
+
+    def send(self, text):
+        response = self.client.post('/api/messages/', {'conversation': self.conversation_id, 'message_text': text})
+        self.assertEqual(response.status_code, 201)
+
+    def deliver(self):
+        with override_settings(EXPO_PUSH_URL=f'http://127.0.0.1:{self.server.server_port}/'):
+            with push_session() as session:
+                return deliver_due_notifications(session)
+
+    def test_sending_never_waits_on_the_expo_request(self):
+        self.send('one')
+        seen = []
+
+        def during_request():
+            # Runs on the stub server's thread, over its own connection
+            try:
+                seen.append(PushNotification.objects.get().status)
+                with connection.cursor() as cursor:
+                    cursor.execute("SET lock_timeout = '2s'")
+                self.send('meanwhile')
+            finally:
+                connections.close_all()
+
+        self.server.during_request = during_request
+        self.server.replies.append((200, {'data': [{'status': 'ok'}]}))
+        self.assertEqual(self.deliver(), 1)
+
+        self.assertEqual(seen, ['sending'])
+        first, second = PushNotification.objects.order_by('pk')
+        self.assertEqual((first.status, first.body, first.lease_until), ('sent', 'one', None))
+        # Too late to join the batch in flight: queued on its own, held for the coalescing window
+        self.assertEqual((second.status, second.message_count, second.body), ('pending', 1, 'meanwhile'))
+        self.assertGreater(second.next_attempt_at, timezone.now())
+
+    def test_expired_leases_are_sent_again(self):
+        self.send('one')
+        PushNotification.objects.update(status='sending', lease_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.deliver(), 0)
+
+        # The worker holding it died: once the lease runs out it is claimed again
+        PushNotification.objects.update(lease_until=timezone.now() - timedelta(seconds=1))
+        self.server.replies.append((200, {'data': [{'status': 'ok'}]}))
+        self.assertEqual(self.deliver(), 1)
+        self.assertEqual(PushNotification.objects.get().status, 'sent')
+
+
+class MessageSearchTests(TestCase):
+
+    def setUp(self):
+        self.user, self.alice, self.bob = make_user(0), make_user(1), make_user(2)
+        with_alice, _ = direct_conversation(self.user, self.alice)
+        with_bob, _ = direct_conversation(self.user, self.bob)
+        strangers, _ = direct_conversation(self.alice, self.bob)
+        for conversation, sender, text in [
+            (with_alice, self.alice, 'Is the room in Kilimani still free?'),
+            (with_alice, self.user, 'Yes, the room is free from June'),
+            (with_bob, self.bob, 'Room room room! Kilimani room available'),
+            (with_bob, self.bob, 'See you tomorrow'),
+            (strangers, self.alice, 'Private: the Kilimani room is a scam'),
+        ]:
+            Message.objects.create(conversation=conversation, sender=sender, message_text=text)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/messages/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_hits_from_own_conversations_only(self):
+        data = self.search(q='kilimani room')
+        texts = [hit['message_text'] for hit in data['results']]
+        self.assertEqual(texts, ['Room room room! Kilimani room available', 'Is the room in Kilimani still free?'])
+        self.assertIn('<b>Kilimani</b>', data['results'][1]['snippet'])
+        self.assertIsNone(data['next'])
+
+    def test_pages_and_conversation_filter(self):
+        first = self.search(q='room', limit=2)
+        self.assertEqual(len(first['results']), 2)
+        rest = self.search(q='room', limit=2, cursor=first['next'])
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+
+        conversation_id = first['results'][0]['conversation']
+        scoped = self.search(q='room', conversation=conversation_id)
+        self.assertEqual({hit['conversation'] for hit in scoped['results']}, {conversation_id})
+
+
+class ListingSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user(0)
+        for title, description, city, area, active in [
+            ('Bedsitter near Yaya', 'Quiet, water all day', 'Nairobi', 'Kilimani', True),
+            ('Shared flat', 'Walking distance to Kilimani shops', 'Nairobi', 'Hurlingham', True),
+            ('Kilimani one bedroom', 'Furnished', 'Nairobi', 'Kilimani', True),
+            ('Nyali studio', 'By the beach', 'Mombasa', 'Nyali', True),
+            ('Old Kilimani room', 'Taken', 'Nairobi', 'Kilimani', False),
+        ]:
+            RoomListing.objects.create(
+                owner=owner, title=title, description=description, city=city, area=area,
+                rent_amount=10000, room_type='single', is_active=active,
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, **params):
+        response = self.client.get('/api/listings/', params)
+        self.assertEqual(response.status_code, 200)
+        return [listing['title'] for listing in response.data['results']], response.data['next']
+
+    def test_title_outranks_location_and_description(self):
+        titles, _ = self.get(q='kilimani')
+        self.assertEqual(titles, ['Kilimani one bedroom', 'Bedsitter near Yaya', 'Shared flat'])
+
+    def test_pages_cover_active_listings_once(self):
+        seen, cursor = [], None
+        while True:
+            titles, cursor = self.get(limit=2, **({'cursor': cursor} if cursor else {}))
+            seen += titles
+            if not cursor:
+                break
+        self.assertEqual(seen, ['Nyali studio', 'Kilimani one bedroom', 'Shared flat', 'Bedsitter near Yaya'])
+
+        titles, cursor = self.get(q='nairobi', limit=2)
+        more, last = self.get(q='nairobi', limit=2, cursor=cursor)
+        self.assertEqual((len(titles), len(more), last), (2, 1, None))
+
+
+class NearbyListingTests(TestCase):
+    CENTER = (-1.2921, 36.8219)  # Nairobi CBD
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user(0)
+        for title, lat, lon in [
+            ('Kilimani', -1.2890, 36.7830),
+            ('Westlands', -1.2676, 36.8108),
+            ('CBD', -1.2841, 36.8233),
+            ('Thika', -1.0333, 37.0693),
+            ('No location', None, None),
+        ]:
+            RoomListing.objects.create(
+                owner=owner, title=title, description='Room', city='Nairobi',
+                latitude=lat, longitude=lon, rent_amount=10000, room_type='single',
+            )
+
+    def near(self, **params):
+        return APIClient().get('/api/listings/', {'near': '%s,%s' % self.CENTER, **params})
+
+    def test_geohash(self):
+        self.assertEqual(encode_geohash(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(RoomListing.objects.get(title='CBD').geohash, encode_geohash(-1.2841, 36.8233))
+        self.assertIsNone(RoomListing.objects.get(title='No location').geohash)
+
+    def test_covering_cells_contain_every_point_in_the_radius(self):
+        lat, lon = self.CENTER
+        cells = covering_cells(lat, lon, 5)
+        for n in range(36):
+            bearing = math.radians(n * 10)
+            point = (lat + 0.044 * math.cos(bearing), lon + 0.044 * math.sin(bearing))
+            self.assertLess(haversine_km(lat, lon, *point), 5)
+            self.assertTrue(any(encode_geohash(*point).startswith(cell) for cell in cells))
+
+    def test_results_are_sorted_by_distance_within_the_radius(self):
+        response = self.near(radius=6)
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['title'] for r in results], ['CBD', 'Westlands', 'Kilimani'])
+        expected = haversine_km(*self.CENTER, -1.2676, 36.8108)
+        self.assertAlmostEqual(results[1]['distance_km'], expected, places=1)
+
+        self.assertEqual([r['title'] for r in self.near(radius=50).data['results']][-1], 'Thika')
+        self.assertEqual(self.near(radius=500).status_code, 400)
+        self.assertEqual(APIClient().get('/api/listings/', {'near': 'nowhere'}).status_code, 400)
+
+
+class ListingFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user(0)
+        for n, (room_type, city, rent, available) in enumerate([
+            ('bedsitter', 'Nairobi', 8000, None),
+            ('bedsitter', 'nairobi', 12000, '2026-01-01'),
+            ('shared', 'Nairobi', 15000, '2026-06-01'),
+            ('apartment', 'Mombasa', 45000, None),
+            ('shared', 'Mombasa', 9000, '2026-03-01'),
+        ]):
+            RoomListing.objects.create(
+                owner=owner, title=f'Listing {n}', description='Room', city=city,
+                rent_amount=rent, room_type=room_type, available_from=available,
+            )
+
+    def get(self, **params):
+        response = APIClient().get('/api/listings/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_filters_combine(self):
+        data = self.get(city='NAIROBI', rent_max=12000)
+        self.assertEqual({r['title'] for r in data['results']}, {'Listing 0', 'Listing 1'})
+        data = self.get(room_type=['bedsitter', 'shared'], available_from='2026-03-01')
+        self.assertEqual({r['title'] for r in data['results']}, {'Listing 0', 'Listing 1', 'Listing 4'})
+
+    def test_facets_follow_the_filters_in_one_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            facets = self.get(rent_min=9000)['facets']
+        self.assertEqual(facets['room_type'], {'shared': 2, 'bedsitter': 1, 'apartment': 1})
+        self.assertEqual(facets['city'], {'Mombasa': 2, 'Nairobi': 2})
+        self.assertEqual(facets['rent'], {'0-10000': 1, '10000-20000': 2, '20000-40000': 0, '40000+': 1})
+        facet_queries = [q for q in captured.captured_queries if 'GROUP BY' in q['sql']]
+        self.assertEqual(len(facet_queries), 1)
+
+
+class ImagePipelineTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(make_user(0))
+
+    def photo(self):
+        # Landscape pixels shot in portrait: EXIF orientation 6 means "rotate 90 degrees"
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'PhoneMaker'
+        exif.get_ifd(0x8825)[0x0002] = (1.0, 17.0, 30.0)  # GPSLatitude
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 600), (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('room.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_uploads_get_resized_exif_free_variants(self):
+        response = self.client.post('/api/listings/', {
+            'title': 'Room', 'description': 'Nice', 'city': 'Nairobi', 'rent_amount': 10000,
+            'room_type': 'bedsitter', 'uploaded_images': [self.photo()],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        image = response.data['images'][0]
+        # The original still carries its EXIF: not exposed until processed
+        self.assertEqual((image['processing_status'], image['variants'], image['image_file']), ('pending', {}, None))
+        uploaded = ListingImage.objects.get().image_file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending_images(), 1)
+        stored = ListingImage.objects.get()
+        self.assertEqual(stored.processing_status, 'ready')
+        self.assertFalse(default_storage.exists(uploaded))
+        with default_storage.open(stored.image_file.name) as f, Image.open(f) as original:
+            self.assertEqual((original.format, original.size), ('JPEG', (600, 1200)))
+            self.assertEqual(dict(original.getexif()), {})
+        for name, edge in [('thumb', 320), ('medium', 800), ('full', 1200)]:
+            variant = stored.variants[name]
+            # Turned upright, never upscaled
+            self.assertEqual((variant['width'], variant['height']), (edge // 2, edge))
+            for fmt in ('webp', 'jpeg'):
+                with default_storage.open(variant[fmt]) as f, Image.open(f) as rendered:
+                    self.assertEqual(rendered.size, (edge // 2, edge))
+                    self.assertEqual(dict(rendered.getexif()), {})
+
+        listing = self.client.get(f"/api/listings/{response.data['listing_id']}/").data
+        self.assertTrue(listing['images'][0]['image_file'].endswith(stored.image_file.name))
+        thumb = listing['images'][0]['variants']['thumb']
+        self.assertTrue(thumb['webp'].startswith('http://testserver/media/variants/room_photos/'))
+        self.assertTrue(thumb['jpeg'].endswith('/thumb.jpeg'))
+
+    def test_broken_uploads_are_marked_failed(self):
+        listing = RoomListing.objects.create(
+            owner=User.objects.get(), title='Room', description='x', city='Nairobi', rent_amount=1, room_type='shared'
+        )
+        ListingImage.objects.create(listing=listing, image_file=SimpleUploadedFile('bad.jpg', b'not an image'))
+        with self.assertLogs('core.images', 'ERROR'):
+            self.assertEqual(process_pending_images(), 1)
+        self.assertEqual(ListingImage.objects.get().processing_status, 'failed')
+
+    def test_uploads_are_decoded_outside_any_transaction(self):
+        listing = RoomListing.objects.create(
+            owner=User.objects.get(), title='Room', description='x', city='Nairobi', rent_amount=1, room_type='shared'
+        )
+        broken = ListingImage.objects.create(listing=listing, image_file=SimpleUploadedFile('bad.jpg', b'not an image'))
+        good = ListingImage.objects.create(listing=listing, image_file=self.photo())
+        # A worker that died mid-batch: picked up again once its lease ran out
+        stale = ListingImage.objects.create(listing=listing, image_file=self.photo())
+        ListingImage.objects.filter(pk=stale.pk).update(
+            processing_status='processing', lease_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        seen, depth = [], len(connection.atomic_blocks)
+        real_strip = strip_metadata
+
+        def strip(source):
+            seen.append((len(connection.atomic_blocks), sorted(ListingImage.objects.values_list('processing_status', flat=True))))
+            return real_strip(source)
+
+        with mock.patch('core.images.strip_metadata', strip), self.assertLogs('core.images', 'ERROR'):
+            self.assertEqual(process_pending_images(), 3)
+        # Claimed and committed first, then no transaction of the worker's own while decoding
+        self.assertEqual(seen[0], (depth, ['failed', 'processing', 'processing']))
+        statuses = dict(ListingImage.objects.values_list('pk', 'processing_status'))
+        self.assertEqual(statuses, {broken.pk: 'failed', good.pk: 'ready', stale.pk: 'ready'})
+        self.assertFalse(ListingImage.objects.exclude(lease_until=None).exists())
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        media, parts = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(parts.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=media.name, UPLOAD_SESSION_DIR=parts.name, UPLOAD_MAX_CHUNK_SIZE=4096
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = make_user(0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        buffer = io.BytesIO()
+        Image.effect_noise((200, 200), 64).convert('RGB').save(buffer, 'PNG')
+        self.photo = buffer.getvalue()
+
+    def put_chunk(self, upload_id, offset, data):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/chunk/', data, content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_listing_photo_resumes_after_a_lost_chunk(self):
+        listing = RoomListing.objects.create(
+            owner=self.user, title='Room', description='x', city='Nairobi', rent_amount=1, room_type='shared'
+        )
+        response = self.client.post('/api/uploads/', {
+            'kind': 'listing_image', 'listing': listing.pk, 'filename': '../../room.png', 'size': len(self.photo)
+        })
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.data['upload_id']
+        self.assertEqual(response.data['filename'], 'room.png')
+
+        chunks = [self.photo[i:i + 4096] for i in range(0, len(self.photo), 4096)]
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(self.put_chunk(upload_id, 0, chunks[0]).data['offset'], 4096)
+        # A resent chunk is refused with the offset to resume from
+        response = self.put_chunk(upload_id, 0, chunks[0])
+        self.assertEqual((response.status_code, response.data), (409, {'offset': 4096}))
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 400)
+
+        # Resume from where the server says the upload stands
+        offset = self.client.get(f'/api/uploads/{upload_id}/').data['received']
+        for chunk in chunks[1:]:
+            response = self.put_chunk(upload_id, offset, chunk)
+            self.assertEqual(response.status_code, 200)
+            offset = response.data['offset']
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['processing_status'], 'pending')
+        image = ListingImage.objects.get(listing=listing)
+        with image.image_file.open('rb') as f:
+            self.assertEqual(f.read(), self.photo)
+        session = UploadSession.objects.get()
+        self.assertFalse(os.path.exists(upload_path(session)))
+        # A retried finalize returns the same image
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual((response.status_code, response.data['image_id']), (200, image.pk))
+
+    def test_chunks_are_read_before_the_session_is_locked(self):
+        response = self.client.post('/api/uploads/', {
+            'kind': 'verification', 'filename': 'id.png', 'size': len(self.photo)
+        })
+        upload_id = response.data['upload_id']
+        depths, depth = [], len(connection.atomic_blocks)
+        real_receive = receive_chunk
+
+        def receive(*args):
+            depths.append(len(connection.atomic_blocks))
+            return real_receive(*args)
+
+        with mock.patch('core.views.receive_chunk', receive), CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.put_chunk(upload_id, 0, self.photo[:4096]).status_code, 200)
+        # A slow client holds neither a transaction nor the row lock while its chunk comes in
+        self.assertEqual(depths, [depth])
+        locks = [q['sql'] for q in captured.captured_queries if 'FOR UPDATE' in q['sql']]
+        self.assertEqual(len(locks), 1)
+        self.assertEqual(UploadSession.objects.get().received, 4096)
+
+    def test_verification_upload_and_validation(self):
+        other = make_user(1)
+        listing = RoomListing.objects.create(
+            owner=other, title='Room', description='x', city='Nairobi', rent_amount=1, room_type='shared'
+        )
+        response = self.client.post('/api/uploads/', {
+            'kind': 'listing_image', 'listing': listing.pk, 'filename': 'a.png', 'size': 10
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/uploads/', {
+            'kind': 'verification', 'filename': 'id.png', 'size': 100 * 1024 * 1024
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/uploads/', {
+            'kind': 'verification', 'document_type': 'passport', 'filename': 'id.png', 'size': len(self.photo)
+        })
+        upload_id = response.data['upload_id']
+        # Chunks over UPLOAD_MAX_CHUNK_SIZE are refused before anything is read
+        self.assertEqual(self.put_chunk(upload_id, 0, self.photo[:8192]).status_code, 400)
+        for offset in range(0, len(self.photo), 4096):
+            self.put_chunk(upload_id, offset, self.photo[offset:offset + 4096])
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        verification = UserVerification.objects.get()
+        self.assertEqual((verification.user, verification.document_type), (self.user, 'passport'))
+
+        # Other users cannot see the session; abandoned ones are expired with their temp files
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').status_code, 404)
+        response = self.client.post('/api/uploads/', {'kind': 'verification', 'filename': 'id.png', 'size': 10})
+        self.put_chunk(response.data['upload_id'], 0, b'12345')
+        stale = UploadSession.objects.get(pk=response.data['upload_id'])
+        self.assertTrue(os.path.exists(upload_path(stale)))
+        UploadSession.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(expire_stale_uploads(timedelta(hours=24)), 1)
+        self.assertFalse(os.path.exists(upload_path(stale)))
+        self.assertEqual(UploadSession.objects.count(), 1)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+from .models import ListingImage, UploadSession, UserVerification
+
+# Read size when streaming a chunk to disk: memory per upload stays at this
+READ_SIZE = 64 * 1024
+
+
+class OffsetMismatch(Exception):
+    """
+    The client's offset is not where the upload stands, e.g. after a lost
+    response; it should resume from `expected`.
+    """
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        self.expected = expected
+
+
+def upload_path(session):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session.upload_id}.part")
+
+
+def receive_chunk(session, stream, offset, length):
+    """
+    Checks one chunk against `session` and streams its `length` bytes from
+    `stream` into an anonymous temp file, returned rewound for append_chunk.
+    Runs before any lock is taken: a slow client holds no transaction or row
+    lock while its chunk comes in.
+    """
+    if offset != session.received:
+        # Rechecked under the lock by append_chunk; saves reading a resent chunk
+        raise OffsetMismatch(session.received)
+    if length <= 0 or length > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise ValidationError({'chunk': f'Chunks must be 1 to {settings.UPLOAD_MAX_CHUNK_SIZE} bytes.'})
+    if offset + length > session.size:
+        raise ValidationError({'chunk': 'Chunk goes past the declared size.'})
+
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    chunk = tempfile.TemporaryFile(dir=settings.UPLOAD_SESSION_DIR)
+    written = 0
+    while written < length:
+        data = stream.read(min(READ_SIZE, length - written))
+        if not data:
+            break
+        chunk.write(data)
+        written += len(data)
+
+    if written != length:
+        # Connection dropped mid-chunk: the client resends it from the same offset
+        chunk.close()
+        raise ValidationError({'chunk': f'Expected {length} bytes, received {written}.'})
+    chunk.seek(0)
+    return chunk
+
+
+def append_chunk(session, chunk, offset, length):
+    """
+    Copies a chunk read by receive_chunk onto the end of the upload's temp file
+    and records the new offset. The caller holds a lock on `session`, so chunks
+    of one upload never interleave.
+    """
+    if offset != session.received:
+        raise OffsetMismatch(session.received)
+
+    with open(upload_path(session), 'ab') as f:
+        # Drop whatever a previously interrupted append left past the committed offset
+        f.truncate(offset)
+        shutil.copyfileobj(chunk, f, READ_SIZE)
+    session.received += length
+    session.save(update_fields=['received', 'updated_at'])
+
+
+def finalize_upload(session):
+    """
+    Checks the completed file is an image and binds it to a new ListingImage or
+    UserVerification (copied into storage in chunks), then drops the temp file.
+    """
+    if session.received != session.size:
+        raise ValidationError({'upload': f'Incomplete: {session.received} of {session.size} bytes received.'})
+
+    path = upload_path(session)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValidationError({'upload': 'Not a valid image.'})
+
+    with open(path, 'rb') as f:
+        upload = File(f, name=session.filename)
+        if session.kind == UploadSession.LISTING_IMAGE:
+            session.listing_image = ListingImage.objects.create(listing=session.listing, image_file=upload)
+            result = session.listing_image
+        else:
+            session.verification = UserVerification.objects.create(
+                user=session.user, document_image=upload, document_type=session.document_type
+            )
+            result = session.verification
+
+    session.status = UploadSession.COMPLETE
+    session.save(update_fields=['status', 'listing_image', 'verification', 'updated_at'])
+    discard_upload(session)
+    return result
+
+
+def discard_upload(session):
+    try:
+        os.remove(upload_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def expire_stale_uploads(max_age):
+    """
+    Deletes open sessions untouched for `max_age` (a timedelta) with their temp
+    files. Returns the number removed.
+    """
+    stale = list(UploadSession.objects.filter(
+        status=UploadSession.OPEN, updated_at__lt=timezone.now() - max_age
+    ))
+    for session in stale:
+        discard_upload(session)
+    UploadSession.objects.filter(pk__in=[s.pk for s in stale]).delete()
+    return len(stale)
@@ -11,7 +11,8 @@ from .views import (
     ReviewViewSet, 
     RegisterView,
     UserVerificationViewSet,
-    RoommateDirectoryViewSet
+    RoommateDirectoryViewSet,
+    UploadSessionViewSet
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -26,6 +27,7 @@ router.register(r'payments', PaymentViewSet)
 router.register(r'reviews', ReviewViewSet)
 router.register(r'verifications', UserVerificationViewSet)
 router.register(r'roommates', RoommateDirectoryViewSet, basename='roommates')
+router.register(r'uploads', UploadSessionViewSet, basename='uploads')
 
 urlpatterns = [
     path('', include(router.urls)),
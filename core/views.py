@@ -1,9 +1,16 @@
-from rest_framework import viewsets, permissions, status
+from datetime import datetime
+
+from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from django.db.models import Q, Max
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, Q
+from django.db.models.lookups import LessThanOrEqual
+from django.conf import settings
 from .models import (User,
  RoomListing,
   Match, 
@@ -12,55 +19,26 @@ from .models import (User,
   Message, 
   Payment, 
   Review, 
-  UserVerification
+  UserVerification,
+  InboxEntry,
+  UploadSession
   ) 
 from .serializers import (
     UserSerializer, RoomListingSerializer, MatchSerializer, 
     UserPreferencesSerializer, ConversationSerializer, 
-    MessageSerializer, PaymentSerializer, ReviewSerializer, UserVerificationSerializer
+    MessageSerializer, PaymentSerializer, ReviewSerializer, UserVerificationSerializer,
+    InboxEntrySerializer, ListingImageSerializer, UploadSessionSerializer
 )
-from .notifications import send_push_notification 
-
-# --- HELPER: SCORING ALGORITHM ---
-def calculate_compatibility(user_prefs, candidate_prefs):
-    score = 0
-    
-    # 1. Cleanliness (Weight: 30%)
-    cleanliness_map = {'low': 1, 'medium': 2, 'high': 3}
-    u_clean = cleanliness_map.get(user_prefs.cleanliness_level.lower(), 2)
-    c_clean = cleanliness_map.get(candidate_prefs.cleanliness_level.lower(), 2)
-    
-    diff = abs(u_clean - c_clean)
-    if diff == 0: score += 30
-    elif diff == 1: score += 15
-    
-    # 2. Smoking (Weight: 20%)
-    if user_prefs.smoking == candidate_prefs.smoking:
-        score += 20
-    elif user_prefs.smoking and not candidate_prefs.smoking: 
-        score += 0
-    
-    # 3. Sleep Schedule (Weight: 20%)
-    if user_prefs.sleep_schedule == candidate_prefs.sleep_schedule:
-        score += 20
-        
-    # 4. Guests (Weight: 15%)
-    if user_prefs.guests_allowed == candidate_prefs.guests_allowed:
-        score += 15
-        
-    # 5. Pets (Weight: 10%)
-    if user_prefs.pets == candidate_prefs.pets:
-        score += 10
-        
-    # 6. Interest Tags (Weight: 5%)
-    if user_prefs.other_interests and candidate_prefs.other_interests:
-        u_tags = set(x.strip().lower() for x in user_prefs.other_interests.split(','))
-        c_tags = set(x.strip().lower() for x in candidate_prefs.other_interests.split(','))
-        common = u_tags.intersection(c_tags)
-        if len(common) > 0:
-            score += 5
-
-    return score
+from .notifications import queue_message_notification
+from .consumers import push_message
+from .pagination import encode_cursor, decode_cursor, parse_limit
+from .recommendations import live_recommendations, match_score, remember_scores, stored_recommendations
+from .interests import parse_interests
+from .filters import listing_facets, RoomListingFilter
+from .geo import covering_cells, distance_km, in_cells, DEFAULT_NEAR_RADIUS_KM, MAX_NEAR_RADIUS_KM
+from .inbox import changes_since, direct_conversation, mark_conversation_read, record_message
+from .uploads import append_chunk, discard_upload, finalize_upload, receive_chunk, OffsetMismatch
+from .matching import top_matches_in_database
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
@@ -75,24 +53,32 @@ class RoommateDirectoryViewSet(viewsets.ReadOnlyModelViewSet):
     # Enable powerful filtering
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['gender', 'preferences__smoking', 'preferences__is_actively_looking']
-    search_fields = ['full_name', 'preferences__target_city', 'preferences__other_interests']
+    search_fields = ['full_name', 'preferences__target_city', 'preferences__interest_tags__name']
     ordering_fields = ['preferences__budget_max', 'date_joined']
 
     def get_queryset(self):
         # 1. Only show people who WANT a room (seekers)
         # 2. Exclude the user themselves
         # 3. Exclude admins
-        return User.objects.filter(
+        queryset = UserSerializer.setup_eager_loading(User.objects.filter(
             preferences__is_actively_looking=True
         ).exclude(
-            id=self.request.user.user_id
-        ).exclude(is_staff=True).select_related('preferences')
+            pk=self.request.user.user_id
+        ).exclude(is_staff=True))
+
+        # 4. ?interest=football (repeatable): exact, indexed lookups on the tag table
+        for tag in parse_interests(','.join(self.request.query_params.getlist('interest'))):
+            queryset = queryset.filter(preferences__interest_tags__name=tag)
+        return queryset
 
 # 1. User ViewSet
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+
+    def get_queryset(self):
+        return UserSerializer.setup_eager_loading(super().get_queryset())
     
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def me(self, request):
@@ -123,10 +109,78 @@ class RoomListingViewSet(viewsets.ModelViewSet):
     queryset = RoomListing.objects.filter(is_active=True).order_by('-created_at')
     serializer_class = RoomListingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = RoomListingFilter
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        """
+        One page of active listings: newest first, best matches first with
+        ?q= (searches title, then city/area, then description), or nearest first
+        with ?near=<lat>,<lon>&radius=<km> (combinable with ?q=). Narrowed by the
+        RoomListingFilter filters; the first page also carries facet counts.
+        """
+        limit = parse_limit(request)
+        cursor = request.query_params.get('cursor')
+        listings = RoomListingSerializer.setup_eager_loading(self.filter_queryset(self.get_queryset()))
+
+        text = request.query_params.get('q', '').strip()
+        near = request.query_params.get('near')
+        if text:
+            query = SearchQuery(text, config='simple', search_type='websearch')
+            listings = listings.filter(search_vector=query)
+        if near:
+            # Only the geohash cells around the point are read, then exact distances
+            lat, lon, radius = self.parse_near(near, request.query_params.get('radius'))
+            listings = listings.filter(
+                in_cells(covering_cells(lat, lon, radius)), LessThanOrEqual(distance_km(lat, lon), radius)
+            )
+        facet_listings = listings
+
+        if text or near:
+            offset = decode_cursor(cursor, int)[0] if cursor else 0
+            if near:
+                listings = listings.annotate(distance_km=distance_km(lat, lon)).order_by('distance_km', 'listing_id')
+            else:
+                # Weighted rank over the GIN-indexed search_vector
+                listings = listings.annotate(
+                    rank=SearchRank(F('search_vector'), query)
+                ).order_by('-rank', '-created_at', '-listing_id')
+            page = list(listings[offset:offset + limit + 1])
+            next_cursor = encode_cursor(offset + limit) if len(page) > limit else None
+            page = page[:limit]
+        else:
+            # Keyset pagination on (created_at, listing_id), served by room_listings_active_idx
+            if cursor:
+                created_at, listing_id = decode_cursor(cursor, datetime.fromisoformat, int)
+                listings = listings.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, listing_id__lt=listing_id)
+                )
+            page = list(listings.order_by('-created_at', '-listing_id')[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1].created_at.isoformat(), page[-1].listing_id) if has_more else None
+
+        data = {"results": self.get_serializer(page, many=True).data, "next": next_cursor}
+        if not cursor:
+            # Counts for the filter screen, over the same filters, in one grouped query
+            data["facets"] = listing_facets(facet_listings)
+        return Response(data)
+
+    def parse_near(self, near, radius):
+        try:
+            lat, lon = (float(part) for part in near.split(','))
+            radius = float(radius) if radius else DEFAULT_NEAR_RADIUS_KM
+        except ValueError:
+            raise ValidationError({'near': 'Expected near=<latitude>,<longitude> and a numeric radius (km).'})
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValidationError({'near': 'Coordinates out of range.'})
+        if not 0 < radius <= MAX_NEAR_RADIUS_KM:
+            raise ValidationError({'radius': f'Must be between 0 and {MAX_NEAR_RADIUS_KM} km.'})
+        return lat, lon, radius
+
 # 3. Preferences ViewSet
 class UserPreferencesViewSet(viewsets.ModelViewSet):
     queryset = UserPreferences.objects.all()
@@ -181,30 +235,37 @@ class MatchViewSet(viewsets.ModelViewSet):
 
     # 2. Filter: Only show MY matches (Requests sent to me OR by me)
     def get_queryset(self):
-        return Match.objects.filter(
+        return MatchSerializer.setup_eager_loading(Match.objects.filter(
             Q(user=self.request.user) | Q(matched_user=self.request.user)
-        )
+        ))
 
     # 3. Create Logic: This handles the "Connect" button
     def perform_create(self, serializer):
         target_user_id = self.request.data.get('matched_user')
         
         if not target_user_id:
-            raise serializers.ValidationError({"matched_user": "This field is required."})
+            raise ValidationError({"matched_user": "This field is required."})
+
+        try:
+            target_user_id = User.objects.values_list('user_id', flat=True).get(pk=target_user_id)
+        except (User.DoesNotExist, ValueError):
+            raise ValidationError({"matched_user": "User not found."})
 
         # Check for duplicates
         if Match.objects.filter(
             Q(user=self.request.user, matched_user_id=target_user_id) |
             Q(user_id=target_user_id, matched_user=self.request.user)
         ).exists():
-            raise serializers.ValidationError({"detail": "Request already sent."})
+            raise ValidationError({"detail": "Request already sent."})
+
+        # Same score the recommendation list showed (memoized when it was served)
+        score = match_score(self.request.user, target_user_id)
 
-        # Save with manually calculated fields
         serializer.save(
             user=self.request.user,
             matched_user_id=target_user_id,
             match_status='pending',
-            compatibility_score=85 
+            compatibility_score=score or 0
         )
 
     def perform_update(self, serializer):
@@ -229,45 +290,45 @@ class MatchViewSet(viewsets.ModelViewSet):
         except UserPreferences.DoesNotExist:
             return Response({"detail": "Complete profile first."}, status=400)
 
-        candidate_prefs = UserPreferences.objects.select_related('user').exclude(user=current_user)
-        ranked_matches = []
-        
-        for candidate_pref in candidate_prefs:
-            candidate_user = candidate_pref.user
-            if candidate_user.is_superuser or candidate_user.is_staff: 
-                continue
-            
-            # 🛑 STRICT GENDER FILTERING (Male-Male / Female-Female)
-            if candidate_user.gender != current_user.gender:
-                continue
-
-            # Skip people I'm already matched with
-            if Match.objects.filter(
-                (Q(user=current_user) & Q(matched_user=candidate_user)) |
-                (Q(user=candidate_user) & Q(matched_user=current_user))
-            ).exists():
-                continue
-
-            # Calculate Score (Simplified for brevity)
-            base_score = calculate_compatibility(my_prefs, candidate_pref)
-            
-            # City penalty
-            if my_prefs.city and candidate_pref.city:
-                if my_prefs.city.lower() != candidate_pref.city.lower():
-                    base_score -= 50
-
-            final_score = max(0, min(100, base_score))
-
-            if final_score >= 10:
-                ranked_matches.append({
-                    "match_id": f"temp_{candidate_user.user_id}",
-                    "compatibility_score": final_score,
-                    "match_status": "recommended",
-                    "user": UserSerializer(candidate_user).data 
-                })
-
-        ranked_matches.sort(key=lambda x: x['compatibility_score'], reverse=True)
-        return Response(ranked_matches)
+        # Keyset pagination on (score desc, user_id), clients usually only need the first page
+        limit = parse_limit(request)
+        cursor = request.query_params.get('cursor')
+        after = decode_cursor(cursor, int, int) if cursor else None
+
+        if settings.RECOMMENDATION_ENGINE == 'materialized':
+            # Read the stored set, kept current by signals when preferences/matches change
+            page = stored_recommendations(current_user, my_prefs, limit + 1, after=after)
+        elif settings.RECOMMENDATION_ENGINE == 'database':
+            # Score and rank in Postgres, only one page of rows comes back
+            top = top_matches_in_database(current_user, my_prefs, limit + 1, after=after)
+            page = [(candidate_pref.user, candidate_pref.match_score) for candidate_pref in top]
+        else:
+            # Staff, other genders and existing matches are excluded in SQL, only the
+            # compact feature columns are loaded and everyone is scored in one pass
+            page = live_recommendations(current_user, my_prefs, limit + 1, after=after)
+
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        # Connecting from this list reuses these scores instead of recomputing them
+        remember_scores(current_user.user_id, [(candidate_user.user_id, final_score) for candidate_user, final_score in page])
+
+        # Only the returned page is serialized
+        ranked_matches = [
+            {
+                "match_id": f"temp_{candidate_user.user_id}",
+                "compatibility_score": final_score,
+                "match_status": "recommended",
+                "user": UserSerializer(candidate_user).data 
+            }
+            for candidate_user, final_score in page
+        ]
+        next_cursor = None
+        if has_more:
+            last_user, last_score = page[-1]
+            next_cursor = encode_cursor(last_score, last_user.user_id)
+
+        return Response({"results": ranked_matches, "next": next_cursor})
 
 # 5. Conversation ViewSet (FIXED)
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -276,12 +337,52 @@ class ConversationViewSet(viewsets.ModelViewSet):
     queryset = Conversation.objects.all()  # Required for router registration
 
     def get_queryset(self):
-        # Return conversations for current user, ordered by most recent activity
-        return Conversation.objects.filter(
+        return ConversationSerializer.setup_eager_loading(Conversation.objects.filter(
             participants=self.request.user
-        ).annotate(
-            latest_message=Max('messages__sent_at')
-        ).order_by('-latest_message')
+        ))
+
+    def list(self, request, *args, **kwargs):
+        # The inbox: one indexed read of the user's rows, most recent activity first
+        entries = InboxEntrySerializer.setup_eager_loading(
+            InboxEntry.objects.filter(user=request.user)
+        ).order_by('-last_activity_at')
+        return Response(InboxEntrySerializer(entries, many=True).data)
+
+    @action(detail=True, methods=['post'])
+    def mark_read(self, request, pk=None):
+        """
+        Marks the conversation as read up to message id `up_to` (everything if omitted).
+        """
+        entry = get_object_or_404(InboxEntry, user=request.user, conversation_id=pk)
+        up_to = request.data.get('up_to')
+        if up_to is not None:
+            try:
+                up_to = int(up_to)
+            except (TypeError, ValueError):
+                raise ValidationError({'up_to': 'Must be a message id.'})
+        marked, unread_count = mark_conversation_read(entry, up_to)
+        return Response({"marked": marked, "unread_count": unread_count})
+
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Delta sync: pass the `watermark` of the previous response as ?since= to get
+        only the conversations and messages (new, or with a new read state) changed
+        after it. Without ?since= the full inbox comes back, with a first watermark.
+        Call again right away while `has_more` is true. A row may come back again
+        in a later response: replace it by its id.
+        """
+        since = request.query_params.get('since')
+        if since:
+            since = decode_cursor(since, int, int, int, int, int)
+        entries, messages, watermark, has_more = changes_since(request.user, since or None)
+
+        return Response({
+            "conversations": InboxEntrySerializer(InboxEntrySerializer.setup_eager_loading(entries), many=True).data,
+            "messages": MessageSerializer(messages, many=True, context=self.get_serializer_context()).data,
+            "watermark": encode_cursor(*watermark),
+            "has_more": has_more,
+        })
 
     def get_serializer_context(self):
         # Ensure request context is passed to serializer
@@ -299,26 +400,16 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
         try:
             target_user = User.objects.get(pk=target_user_id)
-        except User.DoesNotExist:
+        except (User.DoesNotExist, ValueError):
             return Response({"error": "User not found"}, status=404)
+        if target_user.pk == current_user.pk:
+            return Response({"error": "Cannot start a conversation with yourself"}, status=400)
 
-        # Check if chat already exists between these two users
-        existing_chat = Conversation.objects.filter(
-            participants=current_user
-        ).filter(
-            participants=target_user
-        ).first()
-
-        if existing_chat:
-            serializer = self.get_serializer(existing_chat)
-            return Response(serializer.data)
+        # One indexed lookup on the pair key, created atomically if missing
+        chat, created = direct_conversation(current_user, target_user)
 
-        # Create new conversation
-        chat = Conversation.objects.create()
-        chat.participants.add(current_user, target_user)
-        
         serializer = self.get_serializer(chat)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 # 6. Message ViewSet (FIXED)
 class MessageViewSet(viewsets.ModelViewSet):
@@ -333,9 +424,81 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Message.objects.filter(
                 conversation_id=conversation_id, 
                 conversation__participants=self.request.user
-            ).select_related('sender').order_by('sent_at')
+            ).select_related('sender').order_by('sent_at', 'message_id')
         return Message.objects.none()
 
+    def list(self, request, *args, **kwargs):
+        """
+        One page of history, oldest first. Without a cursor: the latest messages.
+        ?before=<older cursor> pages back in time, ?after=<newer cursor> fetches
+        what arrived since (e.g. when polling).
+        """
+        # Keyset pagination on (sent_at, message_id), served by messages_history_idx
+        limit = parse_limit(request, default=50)
+        before, after = request.query_params.get('before'), request.query_params.get('after')
+        if before and after:
+            raise ValidationError({'cursor': 'Use either before or after, not both.'})
+
+        messages = self.get_queryset()
+        if after:
+            sent_at, message_id = decode_cursor(after, datetime.fromisoformat, int)
+            messages = messages.filter(Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id))
+            page = list(messages[:limit])
+            has_more_older = True
+        else:
+            if before:
+                sent_at, message_id = decode_cursor(before, datetime.fromisoformat, int)
+                messages = messages.filter(Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id))
+            # Walk the index backwards from the cursor, then flip the page to chronological order
+            page = list(messages.order_by('-sent_at', '-message_id')[:limit + 1])
+            has_more_older = len(page) > limit
+            page = page[:limit][::-1]
+
+        def cursor(message):
+            return encode_cursor(message.sent_at.isoformat(), message.message_id)
+
+        return Response({
+            "results": self.get_serializer(page, many=True).data,
+            "older": cursor(page[0]) if page and has_more_older else None,
+            # Always handed out on a non-empty page, so clients can poll for new messages
+            "newer": cursor(page[-1]) if page else after,
+        })
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over the messages of the user's conversations (or of one,
+        with ?conversation=), best hits first, each with a highlighted snippet.
+        """
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'Search text required.'})
+        limit = parse_limit(request)
+        cursor = request.query_params.get('cursor')
+        offset = decode_cursor(cursor, int)[0] if cursor else 0
+
+        # Matches on the GIN-indexed search_vector; inbox rows scope it to the user's chats
+        query = SearchQuery(text, config='simple', search_type='websearch')
+        hits = Message.objects.filter(
+            conversation__inbox_entries__user=request.user, search_vector=query
+        )
+        conversation_id = request.query_params.get('conversation')
+        if conversation_id:
+            hits = hits.filter(conversation_id=conversation_id)
+        hits = hits.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            snippet=SearchHeadline('message_text', query, config='simple', start_sel='<b>', stop_sel='</b>', max_words=20, min_words=8),
+        ).select_related('sender').order_by('-rank', '-sent_at', '-message_id')
+
+        page = list(hits[offset:offset + limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        results = self.get_serializer(page, many=True).data
+        for result, hit in zip(results, page):
+            result['snippet'] = hit.snippet
+        return Response({"results": results, "next": encode_cursor(offset + limit) if has_more else None})
+
     def get_serializer_context(self):
         # Pass request to serializer for is_me field
         context = super().get_serializer_context()
@@ -343,20 +506,20 @@ class MessageViewSet(viewsets.ModelViewSet):
         return context
 
     def perform_create(self, serializer):
-        message = serializer.save(sender=self.request.user)
-        
-        # 1. Identify the recipient (it's a chat, so it's the OTHER person)
-        conversation = message.conversation
-        recipient = conversation.participants.exclude(user_id=self.request.user.user_id).first()
-        
-        if recipient and recipient.expo_push_token:
-            # 2. Send Notification
-            send_push_notification(
-                token=recipient.expo_push_token,
-                title=f"New message from {self.request.user.full_name}",
-                body=message.message_text,
-                data={"conversation_id": conversation.conversation_id}
-            )
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            record_message(message)
+
+            # 1. Identify the recipient (it's a chat, so it's the OTHER person)
+            conversation = message.conversation
+            recipient = conversation.participants.exclude(user_id=self.request.user.user_id).first()
+
+            if recipient:
+                # 2. Queue the push notification (bursts are coalesced), the send_notifications worker delivers it
+                queue_message_notification(recipient, message)
+
+        # Live delivery to open sockets (the sender's other devices too)
+        push_message(message, [self.request.user.user_id] + ([recipient.user_id] if recipient else []))
 
 # 7. Payment ViewSet
 class PaymentViewSet(viewsets.ModelViewSet):
@@ -410,4 +573,59 @@ class UserVerificationViewSet(viewsets.ModelViewSet):
         verification.verification_status = 'rejected'
         verification.rejection_reason = reason
         verification.save()
-        return Response({'status': 'rejected'})
\ No newline at end of file
+        return Response({'status': 'rejected'})
+
+# 10. Resumable chunked uploads
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    # POST to open a session, PUT each chunk to chunk/ with an Upload-Offset header,
+    # then POST finalize/. After a dropped connection, GET the session and resume
+    # from its `received` offset.
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def locked_session(self, pk):
+        return get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise ValidationError({'offset': 'Send the chunk offset in the Upload-Offset header.'})
+
+        try:
+            session = get_object_or_404(self.get_queryset(), pk=pk)
+            if session.status != UploadSession.OPEN:
+                return Response({'detail': 'Upload already finalized.'}, status=status.HTTP_409_CONFLICT)
+            # Read from the raw stream, before any lock: the chunk is never parsed or buffered whole
+            with receive_chunk(session, request.stream, offset, length) as chunk, transaction.atomic():
+                session = self.locked_session(pk)
+                if session.status != UploadSession.OPEN:
+                    return Response({'detail': 'Upload already finalized.'}, status=status.HTTP_409_CONFLICT)
+                append_chunk(session, chunk, offset, length)
+        except OffsetMismatch as e:
+            return Response({'offset': e.expected}, status=status.HTTP_409_CONFLICT)
+        return Response({'offset': session.received, 'size': session.size})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        with transaction.atomic():
+            session = self.locked_session(pk)
+            if session.status == UploadSession.COMPLETE:
+                # Retried after a lost response: return the same result
+                result = session.listing_image or session.verification
+                code = status.HTTP_200_OK
+            else:
+                result = finalize_upload(session)
+                code = status.HTTP_201_CREATED
+        serializer_class = ListingImageSerializer if session.kind == UploadSession.LISTING_IMAGE else UserVerificationSerializer
+        return Response(serializer_class(result, context={'request': request}).data, status=code)
+
+    def perform_destroy(self, instance):
+        discard_upload(instance)
+        instance.delete()
@@ -47,6 +47,7 @@ CSRF_TRUSTED_ORIGINS = [
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',  # runserver serves HTTP and WebSockets through ASGI
     'jazzmin',                  
     'django.contrib.admin',
     'django.contrib.auth',
@@ -54,11 +55,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party
     'rest_framework',
     'drf_spectacular',
     'django_filters',
+    'channels',
     
     # Local apps
     'core',
@@ -94,6 +97,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'roommate_project.wsgi.application'
+ASGI_APPLICATION = 'roommate_project.asgi.application'
+
+# Real-time chat. The in-memory layer only reaches sockets of the same process:
+# running several workers needs a shared layer (e.g. channels_redis).
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
 
 
 # Database
@@ -150,6 +162,25 @@ SIMPLE_JWT = {
     'USER_ID_FIELD': 'user_id',
 }
 
+# Recommendation engine: 'materialized' reads stored per-user scores (kept
+# current on preference/match changes by `manage.py refresh_recommendations`),
+# 'python' scores candidates in the app process, 'database' scores and ranks
+# them in Postgres and only fetches one page.
+RECOMMENDATION_ENGINE = os.environ.get('RECOMMENDATION_ENGINE', 'materialized')
+
+# Candidates stored per user by the materialized engine; pages past them are scored live
+RECOMMENDATION_STORE_LIMIT = 200
+
+# How long a computed pair score is reused (e.g. when connecting from the list)
+MATCH_SCORE_TTL = 300
+
+# Push notifications are queued in an outbox and sent by `manage.py send_notifications`
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+# Chat pushes for one conversation within this many seconds merge into one ("3 new messages from X")
+PUSH_COALESCE_SECONDS = 30
+# At most this many pushes per recipient per minute, the rest waits
+PUSH_RATE_LIMIT = 10
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -220,4 +251,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # FOR IMAGES
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Chunked uploads (api/uploads/): partial files are kept here until finalized
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', os.path.join(BASE_DIR, 'tmp', 'uploads'))
+UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 2 * 1024 * 1024